@@ -1,5 +1,4 @@
 import numpy as np
-from copy import deepcopy
 
 
 def get_set_generic(name):
@@ -18,10 +17,18 @@ class GameGlue:
     name = get_set_generic('name')
     board = get_set_generic('board')
 
-    def __init__(self, game):
+    def __init__(self, game, canonical=False):
+        """
+        Args:
+            game: a Game object
+            canonical(bool): give symmetric positions the same state key
+        """
         self.game = game
+        self.canonical = canonical
         self.last_state = None
         self.ended = 0
+        # private game used to compute transitions between states
+        self.scratch = game.__class__()
 
     @property
     def state(self):
@@ -31,17 +38,18 @@ class GameGlue:
     def state(self, state):
         self.last_state = state[0]
         self.ended = state[1]
-        board = []
-        for i in state[2]:
-            board.append(np.array(i, dtype=np.uint8))
-        self.game.board = np.array(board, dtype=np.uint8)
+        self.game.decode(state[2])
 
     @state.getter
     def state(self):
-        board = (),
-        for i in self.game.board:
-            board = board + (tuple(i),)
-        return (self.last_state, self.ended, board[1:])
+        """
+        a state is the immutable tuple (last_state, ended, code, key), where
+        code is the compact board representation given by game.encode and
+        key is the integer given by game.key, which identifies the position
+        regardless of how it was reached
+        """
+        code = self.game.encode()
+        return (self.last_state, self.ended, code, self.key(code))
 
     def restart(self):
         self.game.restart()
@@ -60,34 +68,84 @@ class GameGlue:
         return self.last_state
 
     def starting_state(self):
-        return self.__class__(self.game.__class__()).state
+        code = self.game.__class__().encode()
+        return (None, 0, code, self.key(code))
+
+    def key(self, code):
+        if self.canonical:
+            return self.scratch.canonical_key(code)
+        return self.scratch.key(code)
+
+    def symmetry(self, state_from, state_to):
+        """
+        Args:
+            state_from(tuple), state_to(tuple): states of symmetric positions
+
+        returns the index s of the symmetry of the game (see
+        Game.symmetries) that maps the board of state_from to the board of
+        state_to
+        """
+        game = self.scratch
+        game.decode(state_from[2])
+        board_from = game.board.ravel()
+        game.decode(state_to[2])
+        board_to = game.board.ravel()
+        board_perms, policy_perms = game.symmetries()
+        for s in range(len(board_perms)):
+            if np.array_equal(board_from[board_perms[s]], board_to):
+                return s
 
     def pack_state(self, data):
         self.state = data
         return self.state
 
     def next_state(self, state, action):
-        game_copy = deepcopy(self)
-        game_copy.state = state
-        game_copy.step(action)
-        game_copy.invert_board()
-        return game_copy.state
-
-    def legal_actions(self, last_state):
-        game_copy = deepcopy(self)
-        game_copy.state = last_state
-        return game_copy.legal_moves()
-
-    def win_values(self, history):
-        game_copy = deepcopy(self)
-        game_copy.state = history
-
-        if not history[1]:
+        """
+        Args:
+            state(tuple): a state as returned by self.state
+            action: a legal action in that state
+
+        returns the state reached after the action, seen from the
+        perspective of the player who moves next
+        """
+        game = self.scratch
+        game.decode(state[2])
+        game.terminal = False
+        reward = game.step(action)
+        ended = game.terminal
+        game.invert_board()
+        code = game.encode()
+        return (reward, ended, code, self.key(code))
+
+    def rollout(self, state, max_plies):
+        """
+        Args:
+            state(tuple): a state as returned by self.state
+            max_plies(int): maximum number of random moves
+
+        returns the state reached by a random game from the state, and the
+        number of moves played. The moves are played on the native board
+        of the game, without building the intermediate states.
+        """
+        game = self.scratch
+        game.decode(state[2])
+        game.terminal = False
+        reward, plies = game.rollout(max_plies)
+        code = game.encode()
+        return (reward, game.terminal, code, self.key(code)), plies
+
+    def legal_actions(self, state):
+        game = self.scratch
+        game.decode(state[2])
+        return game.legal_moves()
+
+    def win_values(self, state):
+        if not state[1]:
             return
 
-        if game_copy.last_state == 1:
+        if state[0] == 1:
             return 1
-        elif game_copy.last_state == 0:
+        elif state[0] == 0:
             return 0
         else:
             return -1
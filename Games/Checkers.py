@@ -1,9 +1,36 @@
 import math
-import copy
-from functools import reduce
 import numpy as np
 from Games.Games import Game
 
+# action space shared by all the instances: action_space[i, j] = [i, j]
+ACTION_SPACE = np.stack(np.meshgrid(np.arange(32), np.arange(32),
+                                    indexing='ij'), axis=-1).astype(np.uint8)
+
+
+def neighbor(square, direction):
+    """
+    Args:
+        square(int): one of the 32 playable squares, 4 * row + col
+        direction(int): 0 and 1 go forward (towards row 7) on the right and
+            on the left, 2 and 3 go backward on the right and on the left
+
+    returns the adjacent square in the direction, -1 outside of the board
+    """
+    row, col = divmod(square, 4)
+    # the squares of the odd rows are shifted to the right
+    col += row % 2 - direction % 2
+    row += 1 if direction < 2 else -1
+    if 0 <= row < 8 and 0 <= col < 4:
+        return 4 * row + col
+    return -1
+
+
+# NEIGHBORS[s][d] is the square adjacent to s in direction d, and
+# JUMPS[s][d] the square behind it where a capture lands
+NEIGHBORS = [[neighbor(s, d) for d in range(4)] for s in range(32)]
+JUMPS = [[neighbor(n, d) if n >= 0 else -1 for d, n in enumerate(NEIGHBORS[s])]
+         for s in range(32)]
+
 
 class Checkers(Game):
     EMPTY_SPOT = 0
@@ -35,13 +62,7 @@ class Checkers(Game):
             spots = old_spots
         self.board = np.array(spots, dtype=np.uint8)
 
-        # initialize action space
-        action_space = np.zeros((32, 32, 2), dtype=np.uint8)
-        for i in range(32):
-            for j in range(32):
-                action_space[i, j] = np.array([i, j])
-
-        super().__init__(8, 4, 4, action_space, 'Checkers')
+        super().__init__(8, 4, 4, ACTION_SPACE, 'Checkers')
 
     def tile_to_row_col(self, tile):
         """
@@ -87,113 +108,58 @@ class Checkers(Game):
         """
         self.board = np.rot90((5 - self.board) % 5, 2)
 
-    def not_spot(self, loc):
-        """
-        Finds out of the spot at the given location is an actual spot on the game board.
-        """
-        if len(loc) == 0 or loc[0] < 0 or loc[0] > self.HEIGHT - 1 or loc[1] < 0 or \
-                loc[1] > self.WIDTH - 1:
-            return True
-        else:
-            return False
-
-    def get_spot_info(self, loc):
-        """
-        Gets the information about the spot at the given location.
-        """
-        return self.board[loc[0]][loc[1]]
-
-    def forward_n_locations(self, start_loc, n, backwards=False):
-        """
-        Gets the locations possible for moving a piece from a given location diagonally
-        forward (or backwards if wanted) a given number of times(without directional change midway).
-        """
-        if n % 2 == 0:
-            temp1 = 0
-            temp2 = 0
-        elif start_loc[0] % 2 == 0:
-            temp1 = 0
-            temp2 = 1
-        else:
-            temp1 = 1
-            temp2 = 0
-
-        answer = [[start_loc[0], start_loc[1] + math.floor(n / 2) + temp1],
-                  [start_loc[0], start_loc[1] - math.floor(n / 2) - temp2]]
-
-        if backwards:
-            answer[0][0] = answer[0][0] - n
-            answer[1][0] = answer[1][0] - n
-        else:
-            answer[0][0] = answer[0][0] + n
-            answer[1][0] = answer[1][0] + n
-
-        if self.not_spot(answer[0]):
-            return [answer[1]]
-        elif self.not_spot(answer[1]):
-            return [answer[0]]
-        else:
-            return answer
-
-    def get_simple_moves(self, start_loc):
-        """
-        Gets the possible moves a piece can make given that it does not capture any
-        opponents pieces.
-        """
-        next_locations = self.forward_n_locations(start_loc, 1)
-        if self.get_spot_info(start_loc) == self.P1_K:
-            next_locations.extend(self.forward_n_locations(start_loc, 1, True))
-
-        possible_next_locations = []
+    def capture_sequences(self, cells, square, king, path, captured, sequences):
+        """
+        Recursively finds the captures of the piece standing on the square,
+        making every jump in place on cells and unmaking it afterwards.
+        Every complete sequence is appended to sequences as the list of the
+        squares visited and the list of the squares captured.
+        """
+        extended = False
+        for direction in (range(4) if king else range(2)):
+            over = NEIGHBORS[square][direction]
+            land = JUMPS[square][direction]
+            if land < 0 or cells[land] != self.EMPTY_SPOT or \
+                    cells[over] not in (self.P2, self.P2_K):
+                continue
+            extended = True
+
+            # make the jump
+            piece = cells[over]
+            cells[over] = self.EMPTY_SPOT
+            cells[land] = cells[square]
+            cells[square] = self.EMPTY_SPOT
+            path.append(land)
+            captured.append(over)
+
+            if land // self.WIDTH == self.HEIGHT - 1 and not king:
+                # a man reaching the last row is crowned and stops there
+                sequences.append((list(path), list(captured)))
+            else:
+                self.capture_sequences(cells, land, king, path, captured,
+                                       sequences)
 
-        for location in next_locations:
-            if self.get_spot_info(location) == self.EMPTY_SPOT:
-                possible_next_locations.append(location)
+            # unmake it
+            path.pop()
+            captured.pop()
+            cells[square] = cells[land]
+            cells[land] = self.EMPTY_SPOT
+            cells[over] = piece
 
-        return [[start_loc, end_spot] for end_spot in possible_next_locations]
+        if not extended and len(path) > 1:
+            sequences.append((list(path), list(captured)))
 
-    def get_capture_moves(self, start_loc, move_beginnings=None):
+    def get_captures(self, cells):
         """
-        Recursively get all of the possible moves for a piece which involve capturing an
-        opponent's piece.
+        Gets all the capture sequences of the current player.
         """
-        if move_beginnings is None:
-            move_beginnings = [start_loc]
-
-        answer = []
-
-        next1 = self.forward_n_locations(start_loc, 1)
-        next2 = self.forward_n_locations(start_loc, 2)
-        if self.get_spot_info(start_loc) == self.P1_K:
-            # go also backwards if is a king
-            next1.extend(self.forward_n_locations(start_loc, 1, True))
-            next2.extend(self.forward_n_locations(start_loc, 2, True))
-
-        for j in range(len(next1)):
-            # if both spots exist
-            if (not self.not_spot(next2[j])) and (not self.not_spot(next1[j])):
-                # if next spot is opponent
-                if self.get_spot_info(next1[j]) in [self.P2, self.P2_K]:
-                    # if next next spot is empty
-                    if self.get_spot_info(next2[j]) == self.EMPTY_SPOT:
-                        temp_move1 = copy.deepcopy(move_beginnings)
-                        temp_move1.append(next2[j])
-
-                        answer_length = len(answer)
-
-                        if next2[j][0] != self.HEIGHT - 1 or self.get_spot_info(start_loc) == self.P1_K:
-                            temp_move2 = [start_loc, next2[j]]
-
-                            temp_board = Checkers(copy.deepcopy(self.board))
-                            temp_board.step(
-                                self.move_to_action(temp_move2), True)
-
-                            answer.extend(temp_board.get_capture_moves(
-                                temp_move2[1], temp_move1))
-
-                        if len(answer) == answer_length:
-                            answer.append(temp_move1)
-        return answer
+        sequences = []
+        for square in range(32):
+            if cells[square] == self.P1 or cells[square] == self.P1_K:
+                self.capture_sequences(cells, square,
+                                       cells[square] == self.P1_K,
+                                       [square], [], sequences)
+        return sequences
 
     def check_win_conditions(self):
         """
@@ -201,95 +167,92 @@ class Checkers(Game):
         or draw.
         """
         if not self.check_ahead():
+            # the other player cannot move, or has no pieces left
             self.terminal = True
             return 1
-
-        if np.any(self.board == self.P2) or np.any(self.board == self.P2_K):
-            # if the other player has still pieces left
-            return 0
-        else:
-            # if the other player has no pieces left
-            self.terminal = True
-            return 1
+        return 0
 
     def check_ahead(self):
         """
-        Check get the legal moves one move ahead.
-        """
-        temp_game = Checkers(copy.deepcopy(self.board))
-        temp_game.invert_board()
-        return temp_game.legal_moves()
-
-    def get_piece_locations(self):
+        Checks whether the other player can move, from the current board.
+        The pieces of the other player move towards row 0.
         """
-        Gets all the pieces of the current player
-        """
-        piece_locations = np.argwhere(self.board == self.P1).tolist(
-        ) + np.argwhere(self.board == self.P1_K).tolist()
-        return piece_locations
+        cells = self.board.ravel().tolist()
+        for square in range(32):
+            piece = cells[square]
+            if piece == self.P2:
+                directions = (2, 3)
+            elif piece == self.P2_K:
+                directions = (0, 1, 2, 3)
+            else:
+                continue
+            for direction in directions:
+                adjacent = NEIGHBORS[square][direction]
+                if adjacent < 0:
+                    continue
+                if cells[adjacent] == self.EMPTY_SPOT:
+                    return True
+                land = JUMPS[square][direction]
+                if land >= 0 and cells[land] == self.EMPTY_SPOT and \
+                        cells[adjacent] in (self.P1, self.P1_K):
+                    return True
+        return False
 
     def legal_moves(self):
         """
-        Gets the possible moves that can be made from the current board configuration.
+        Gets the possible moves that can be made from the current board
+        configuration. Captures are mandatory, a capture is the action
+        [start, end] of a whole sequence of jumps. When several sequences
+        lead from start to end capturing different pieces, the action only
+        stands for the first one found, which is the one played by step.
         """
-        actions = []
-        piece_locations = self.get_piece_locations()
-        capture_moves = []
-        try:
-            capture_moves = list(reduce(lambda a, b: a + b, list(map(
-                self.get_capture_moves, piece_locations))))
-        except:
-            capture_moves = []
-
-        if len(capture_moves) != 0:
-            actions = []
-            for capture_move in capture_moves:
-                actions.append(self.move_to_action(capture_move))
-            return actions
+        cells = self.board.ravel().tolist()
+        sequences = self.get_captures(cells)
+        if sequences:
+            actions = {}
+            for path, captured in sequences:
+                actions.setdefault((path[0], path[-1]), None)
+            return [list(action) for action in actions]
 
         moves = []
-        try:
-            moves = list(reduce(lambda a, b: a + b,
-                                list(map(self.get_simple_moves, piece_locations))))
-        except:
-            moves = []
-        actions = np.zeros((len(moves), 2))
-        for i in range(len(moves)):
-            actions[i] = self.move_to_action(moves[i])
-        # print(actions.tolist())
-        return actions.astype(int).tolist()
-
-    def step(self, action, is_capture_temp=False):
-        """
-        Makes a given move on the board, and (as long as is wanted) switches the indicator for which players turn it is.
-        """
-        move = self.action_to_move(action)
-        if abs(int(move[0][0]) - int(move[1][0])) == 2:
-            for j in range(len(move) - 1):
-                if move[j][0] % 2 == 1:
-                    if move[j + 1][1] < move[j][1]:
-                        middle_y = move[j][1]
-                    else:
-                        middle_y = move[j + 1][1]
-                else:
-                    if move[j + 1][1] < move[j][1]:
-                        middle_y = move[j + 1][1]
-                    else:
-                        middle_y = move[j][1]
-
-                self.board[int((move[j][0] + move[j + 1][0]) / 2)
-                           ][middle_y] = self.EMPTY_SPOT
-
-        x_end = move[len(move) - 1][0]
-        y_end = move[len(move) - 1][1]
-
-        # move it
-        if x_end == self.HEIGHT - 1:
-            self.board[x_end][y_end] = self.P1_K
+        for square in range(32):
+            piece = cells[square]
+            if piece != self.P1 and piece != self.P1_K:
+                continue
+            for direction in (range(4) if piece == self.P1_K else range(2)):
+                adjacent = NEIGHBORS[square][direction]
+                if adjacent >= 0 and cells[adjacent] == self.EMPTY_SPOT:
+                    moves.append([square, adjacent])
+        return moves
+
+    def step(self, action):
+        """
+        Makes a given move on the board, and returns 1 if the other player
+        cannot move anymore. A capture takes the pieces of the first
+        sequence of jumps from start to end, see legal_moves.
+        """
+        start, end = int(action[0]), int(action[1])
+        cells = np.ascontiguousarray(self.board).ravel()
+
+        if end not in NEIGHBORS[start]:
+            # a capture, find the jumps leading from start to end
+            sequences = []
+            self.capture_sequences(cells.tolist(), start,
+                                   cells[start] == self.P1_K,
+                                   [start], [], sequences)
+            for path, captured in sequences:
+                if path[-1] == end:
+                    cells[captured] = self.EMPTY_SPOT
+                    break
+
+        # move it, a king may come back to its start square
+        piece = cells[start]
+        cells[start] = self.EMPTY_SPOT
+        if end // self.WIDTH == self.HEIGHT - 1:
+            cells[end] = self.P1_K
         else:
-            self.board[x_end][y_end] = self.board[move[0][0]][move[0][1]]
-
-        self.board[move[0][0]][move[0][1]] = self.EMPTY_SPOT
+            cells[end] = piece
+        self.board = cells.reshape(self.HEIGHT, self.WIDTH)
 
         self.moves_taken += 1
         return self.check_win_conditions()
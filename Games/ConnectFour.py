@@ -1,3 +1,4 @@
+from random import randrange
 import numpy as np
 from Games.Games import Game
 
@@ -23,6 +24,14 @@ class ConnectFour(Game):
     def legal_moves(self):
         return np.where(self.board[0] == 0)[0].tolist()
 
+    def symmetries(self):
+        """
+        the identity and the left-right mirror, which maps column c to 6 - c
+        """
+        cells = np.arange(42).reshape(6, 7)
+        return (np.array([cells.ravel(), cells[:, ::-1].ravel()]),
+                np.array([np.arange(7), np.arange(7)[::-1]]))
+
     def invert_board(self):
         self.board = (3 - self.board) % 3
 
@@ -114,3 +123,157 @@ class ConnectFour(Game):
                 else:
                     print(' O |', end="")
         print('\n')
+
+
+class ConnectFourBitboard(ConnectFour):
+    """
+    ConnectFour engine backed by two bitboards instead of a 6x7 array.
+
+    Every column takes 7 bits (6 cells plus a sentinel bit on top), with the
+    bottom cell of column c stored at bit 7 * c. `current` holds the stones
+    of the player to move (1 in the array representation) and `other` the
+    stones of the opponent (2 in the array representation).
+    """
+
+    H1 = 7
+    FULL = sum(1 << (7 * c + r) for c in range(7) for r in range(6))
+    # bit index of every cell of the 6x7 array, row 0 being the top row
+    BIT_INDEX = np.array([[7 * c + 5 - r for c in range(7)]
+                          for r in range(6)], dtype=np.int64)
+    BIT_VALUE = np.left_shift(1, BIT_INDEX.ravel())
+
+    def __init__(self):
+        self.current = 0
+        self.other = 0
+        self.heights = [self.H1 * c for c in range(7)]
+        super().__init__()
+
+    @property
+    def board(self):
+        return ((np.right_shift(self.current, self.BIT_INDEX) & 1) +
+                2 * (np.right_shift(self.other, self.BIT_INDEX) & 1)).astype(np.uint8)
+
+    @board.setter
+    def board(self, board):
+        board = np.asarray(board).ravel()
+        self.current = int(np.dot(board == 1, self.BIT_VALUE))
+        self.other = int(np.dot(board == 2, self.BIT_VALUE))
+        filled = np.count_nonzero(np.reshape(board, (6, 7)), axis=0)
+        self.heights = [self.H1 * c + int(filled[c]) for c in range(7)]
+
+    def encode(self):
+        return (self.current, self.other)
+
+    def decode(self, code):
+        self.current, self.other = code
+        mask = self.current | self.other
+        self.heights = [self.H1 * c + ((mask >> (self.H1 * c)) & 0x3f).bit_length()
+                        for c in range(7)]
+
+    def key(self, code):
+        """
+        returns:
+            key(int): the 49-bit number current + (current | other), which
+            identifies the position uniquely
+        """
+        current, other = code
+        return current + (current | other)
+
+    def canonical_key(self, code):
+        current, other = code
+        mirror_current = 0
+        mirror_other = 0
+        for c in range(7):
+            mirror_current |= ((current >> (self.H1 * c)) & 0x7f) << (self.H1 * (6 - c))
+            mirror_other |= ((other >> (self.H1 * c)) & 0x7f) << (self.H1 * (6 - c))
+        return min(self.key(code), self.key((mirror_current, mirror_other)))
+
+    def restart(self):
+        self.terminal = False
+        self.current = 0
+        self.other = 0
+        self.heights = [self.H1 * c for c in range(7)]
+
+    def is_valid(self, action):
+        return self.heights[action] < self.H1 * action + 6
+
+    def legal_moves(self):
+        heights = self.heights
+        return [c for c in range(7) if heights[c] < self.H1 * c + 6]
+
+    def invert_board(self):
+        self.current, self.other = self.other, self.current
+
+    @staticmethod
+    def four_in_a_row(position):
+        """
+        Args:
+            position(int): bitboard of the stones of one player
+        returns:
+            True if the bitboard contains four aligned stones
+        """
+        # vertical, horizontal, and the two diagonals
+        for shift in (1, 7, 6, 8):
+            pairs = position & (position >> shift)
+            if pairs & (pairs >> (2 * shift)):
+                return True
+        return False
+
+    def step(self, action):
+        """
+        Args:
+            action(int): a valid action
+        Returns:
+            reward(int) a integer which is either -1,0, or 1
+
+        the bitboards are updated in the process
+        self.terminal is updated in the process
+        """
+        self.current |= 1 << self.heights[action]
+        self.heights[action] += 1
+
+        if self.four_in_a_row(self.current):
+            self.terminal = True
+            return 1
+
+        # checks if board is filled completely
+        if self.current | self.other == self.FULL:
+            self.terminal = True
+
+        return 0
+
+    def rollout(self, max_plies):
+        # same as Game.rollout, on local integers
+        current, other = self.current, self.other
+        heights = self.heights
+        tops = [self.H1 * c + 6 for c in range(7)]
+        moves = [c for c in range(7) if heights[c] < tops[c]]
+        reward = 0
+        plies = 0
+        while moves and plies < max_plies:
+            action = moves[randrange(len(moves))]
+            current |= 1 << heights[action]
+            heights[action] += 1
+            if heights[action] == tops[action]:
+                moves.remove(action)
+            plies += 1
+
+            won = False
+            for shift in (1, 7, 6, 8):
+                pairs = current & (current >> shift)
+                if pairs & (pairs >> (2 * shift)):
+                    won = True
+                    break
+            current, other = other, current
+            if won:
+                reward = 1
+                break
+        self.current, self.other = current, other
+        self.terminal = reward == 1 or not moves
+        return reward, plies
+
+    def layers(self):
+        layers = np.empty((2, 6, 7), dtype=np.uint8)
+        layers[0] = np.right_shift(self.current, self.BIT_INDEX) & 1
+        layers[1] = np.right_shift(self.other, self.BIT_INDEX) & 1
+        return layers
@@ -1,4 +1,5 @@
 import sys
+from random import randrange
 import numpy as np
 
 
@@ -21,6 +22,7 @@ class Game:
         self.obs_space = num_rows * num_cols * num_layers
         self.terminal = False
         self.name = name
+        self.board_perms = None
 
     def layers(self):
         """
@@ -31,11 +33,104 @@ class Game:
             layers(np.ndarray): a matrix with one-hot encoded positions
 
         """
-        layers = np.zeros((self.num_layers, self.num_rows,
-                           self.num_cols), dtype=np.uint8)
-        for k in range(self.num_layers):
-            layers[k] = np.isin(self.board, k + 1)
-        return layers
+        return self.encode_boards(self.board[np.newaxis])[0]
+
+    def encode_boards(self, boards):
+        """
+        Converts many boards into the layers representation at once
+
+        Args:
+            boards(np.ndarray): boards of shape (N, num_rows, num_cols)
+        returns:
+            layers(np.ndarray): one-hot encoded positions of shape
+                (N, num_layers, num_rows, num_cols). Layer k marks the
+                cells holding the piece k + 1.
+        """
+        pieces = np.arange(1, self.num_layers + 1, dtype=np.uint8)
+        boards = np.asarray(boards, dtype=np.uint8)
+        return (boards[:, np.newaxis] ==
+                pieces[:, np.newaxis, np.newaxis]).view(np.uint8)
+
+    def symmetries(self):
+        """
+        Symmetry group of the game, as permutations of the cells and of the
+        actions. A symmetry s maps a board and a policy to
+        board.ravel()[board_perms[s]] and policy[policy_perms[s]].
+
+        returns:
+            board_perms(np.ndarray): shape (S, num_rows * num_cols)
+            policy_perms(np.ndarray): shape (S, len(action_space))
+
+        only the identity by default
+        """
+        return (np.arange(self.num_rows * self.num_cols)[np.newaxis],
+                np.arange(len(self.action_space))[np.newaxis])
+
+    def encode(self):
+        """
+        returns:
+            code(bytes): compact and immutable representation of the board
+        """
+        return self.board.tobytes()
+
+    def decode(self, code):
+        """
+        Args:
+            code: a value returned by encode
+
+        restores the board from its compact representation
+        """
+        self.board = np.frombuffer(code, dtype=np.uint8).reshape(
+            self.num_rows, self.num_cols).copy()
+
+    def key(self, code):
+        """
+        Args:
+            code: a value returned by encode
+        returns:
+            key(int): the board packed into an integer, one byte per cell.
+                It identifies the position and is used to index the
+                search statistics.
+        """
+        return int.from_bytes(code, 'little')
+
+    def canonical_key(self, code):
+        """
+        Args:
+            code: a value returned by encode
+        returns:
+            key(int): the smallest key among the images of the board under
+                the symmetries of the game, equal for symmetric positions
+        """
+        if self.board_perms is None:
+            self.board_perms = self.symmetries()[0]
+        if len(self.board_perms) == 1:
+            return self.key(code)
+        images = np.frombuffer(code, dtype=np.uint8)[self.board_perms]
+        return min(self.key(image.tobytes()) for image in images)
+
+    def rollout(self, max_plies):
+        """
+        Plays random moves from the current board, which is modified in
+        place, until the end of the game or until max_plies moves.
+        Only the sampled move is applied at every ply.
+
+        Args:
+            max_plies(int): maximum number of moves
+        returns:
+            reward(int): the reward of the last move
+            plies(int): the number of moves played
+        """
+        reward = 0
+        plies = 0
+        while not self.terminal and plies < max_plies:
+            moves = self.legal_moves()
+            if not moves:
+                break
+            reward = self.step(moves[randrange(len(moves))])
+            self.invert_board()
+            plies += 1
+        return reward, plies
 
     def restart(self):
         self.terminal = False
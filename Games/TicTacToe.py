@@ -33,6 +33,16 @@ class TicTacToe(Game):
         flat_board = np.reshape(self.board, (9))
         return np.where(flat_board == 0)[0].tolist()
 
+    def symmetries(self):
+        """
+        the 8 rotations and reflections of the board. An action is the
+        index of a cell, so actions are permuted like the cells.
+        """
+        cells = np.arange(9).reshape(3, 3)
+        perms = [np.rot90(board, k).ravel()
+                 for board in (cells, cells.T) for k in range(4)]
+        return np.array(perms), np.array(perms)
+
     def invert_board(self):
         self.board = (3 - self.board) % 3
 
@@ -103,3 +113,148 @@ class TicTacToe(Game):
                 else:
                     print(' O |', end="")
         print('\n')
+
+
+class TicTacToeTable(TicTacToe):
+    """
+    TicTacToe engine answering every call from a table of the positions.
+
+    A board is packed into the integer sum(board[i] * 3 ** i) over the 9
+    cells. The table is built on first use from the 5478 positions
+    reachable from the empty board. For every position it gives the legal
+    moves, their bitmask, and the packed outcome of each action
+    (after << 2) | (terminal << 1) | reward, where after is the board once
+    the stone is placed, before it is inverted.
+    """
+
+    POWERS = [3 ** i for i in range(9)]
+    LINES = [(0, 1, 2), (3, 4, 5), (6, 7, 8), (0, 3, 6), (1, 4, 7),
+             (2, 5, 8), (0, 4, 8), (2, 4, 6)]
+
+    # shared by all the instances, filled by build_table
+    table = None
+    inverted = None
+    canonical = None
+
+    def __init__(self):
+        self.code = 0
+        super().__init__()
+        if TicTacToeTable.table is None:
+            self.build_table()
+
+    @classmethod
+    def cells(cls, code):
+        return [(code // power) % 3 for power in cls.POWERS]
+
+    @classmethod
+    def pack(cls, cells):
+        return sum(cell * power for cell, power in zip(cells, cls.POWERS))
+
+    @classmethod
+    def entry(cls, code):
+        """
+        Args:
+            code(int): a packed board
+        returns:
+            (moves, mask, outcomes) of the board, computed if the board is
+            not in the table yet
+        """
+        entry = cls.table.get(code)
+        if entry is not None:
+            return entry
+
+        cells = cls.cells(code)
+        moves = [a for a in range(9) if cells[a] == 0]
+        mask = 0
+        outcomes = [-1] * 9
+        for a in moves:
+            mask |= 1 << a
+            cells[a] = 1
+            won = any(all(cells[i] == 1 for i in line)
+                      for line in cls.LINES if a in line)
+            terminal = won or 0 not in cells
+            cells[a] = 0
+            outcomes[a] = ((code + cls.POWERS[a]) << 2) | \
+                (terminal << 1) | won
+        entry = (moves, mask, outcomes)
+        cls.table[code] = entry
+        return entry
+
+    @classmethod
+    def invert_code(cls, code):
+        inverted = cls.inverted.get(code)
+        if inverted is None:
+            inverted = cls.pack([(3 - cell) % 3 for cell in cls.cells(code)])
+            cls.inverted[code] = inverted
+        return inverted
+
+    @classmethod
+    def build_table(cls):
+        """
+        fills the table with the positions reachable from the empty board
+        """
+        cls.table = {}
+        cls.inverted = {}
+        cls.canonical = {}
+        frontier = [0]
+        while frontier:
+            code = frontier.pop()
+            if code in cls.table:
+                continue
+            moves, mask, outcomes = cls.entry(code)
+            for a in moves:
+                after = outcomes[a] >> 2
+                following = cls.invert_code(after)
+                if outcomes[a] & 2:
+                    # the end of the game, which stays in the table
+                    cls.entry(following)
+                else:
+                    frontier.append(following)
+
+    @property
+    def board(self):
+        return np.array(self.cells(self.code), dtype=np.uint8).reshape(3, 3)
+
+    @board.setter
+    def board(self, board):
+        self.code = self.pack(np.asarray(board).ravel().tolist())
+
+    def encode(self):
+        return self.code
+
+    def decode(self, code):
+        self.code = code
+
+    def key(self, code):
+        return code
+
+    def canonical_key(self, code):
+        key = self.canonical.get(code)
+        if key is None:
+            if self.board_perms is None:
+                self.board_perms = self.symmetries()[0]
+            cells = self.cells(code)
+            key = min(self.pack([cells[i] for i in perm])
+                      for perm in self.board_perms.tolist())
+            self.canonical[code] = key
+        return key
+
+    def restart(self):
+        self.terminal = False
+        self.code = 0
+
+    def is_valid(self, action):
+        return bool(self.entry(self.code)[1] >> action & 1)
+
+    def legal_moves(self):
+        return list(self.entry(self.code)[0])
+
+    def invert_board(self):
+        self.code = self.invert_code(self.code)
+
+    def step(self, action):
+        outcome = self.entry(self.code)[2][action]
+        self.code = outcome >> 2
+        if outcome & 2:
+            self.terminal = True
+        return outcome & 1
@@ -0,0 +1,170 @@
+import numpy as np
+from Games.TicTacToe import TicTacToe
+from Games.ConnectFour import ConnectFour
+
+
+class VecGame():
+    """
+    B boards of the same game stepped together with NumPy operations.
+
+    boards[b] is a board as in the scalar game, seen from the perspective
+    of the player to move (1 for the stones of the player to move, 2 for
+    the other ones), and terminal[b] tells whether its game has ended.
+    """
+
+    def __init__(self, game, batch_size):
+        """
+        Args:
+            game: a Game object, giving the shape of the boards, the action
+                space and the layers representation
+            batch_size(int): number of boards B
+        """
+        self.game = game
+        self.batch_size = batch_size
+        self.num_actions = len(game.action_space)
+        self.boards = np.zeros((batch_size, game.num_rows, game.num_cols),
+                               dtype=np.uint8)
+        self.terminal = np.zeros(batch_size, dtype=bool)
+
+    def reset(self, mask=None):
+        """
+        Args:
+            mask(np.ndarray - optional): boolean of shape (B,), the boards to
+                restart, all of them by default
+        """
+        if mask is None:
+            mask = np.ones(self.batch_size, dtype=bool)
+        self.boards[mask] = 0
+        self.terminal[mask] = False
+
+    def invert_board(self):
+        self.boards = (3 - self.boards) % 3
+
+    def layers(self):
+        """
+        returns:
+            layers(np.ndarray): the layers representation of all the boards,
+                of shape (B, num_layers, num_rows, num_cols)
+        """
+        return self.game.encode_boards(self.boards)
+
+    def wins(self, flat):
+        """
+        Args:
+            flat(np.ndarray): boards of shape (N, num_rows * num_cols)
+        returns:
+            won(np.ndarray): boolean of shape (N,), whether the stones of the
+                player to move fill one of the LINES
+        """
+        return (flat[:, self.LINES] == 1).all(axis=2).any(axis=1)
+
+
+class VecTicTacToe(VecGame):
+
+    LINES = np.array([(0, 1, 2), (3, 4, 5), (6, 7, 8), (0, 3, 6), (1, 4, 7),
+                      (2, 5, 8), (0, 4, 8), (2, 4, 6)])
+
+    def __init__(self, batch_size):
+        super().__init__(TicTacToe(), batch_size)
+
+    def legal_mask(self):
+        """
+        returns:
+            mask(np.ndarray): boolean of shape (B, 9), the empty cells
+        """
+        return self.boards.reshape(self.batch_size, 9) == 0
+
+    def step(self, actions, active=None):
+        """
+        Args:
+            actions(np.ndarray): one legal action for every board
+            active(np.ndarray - optional): boolean of shape (B,), the boards
+                to play, all the boards which did not end by default
+        returns:
+            rewards(np.ndarray): 1 where the move won the game, 0 elsewhere
+
+        self.boards and self.terminal are updated in the process
+        """
+        if active is None:
+            active = ~self.terminal
+        index = np.flatnonzero(active)
+        flat = self.boards.reshape(self.batch_size, 9)
+        flat[index, actions[index]] = 1
+
+        rewards = np.zeros(self.batch_size, dtype=np.int64)
+        won = self.wins(flat[index])
+        rewards[index[won]] = 1
+        full = (flat[index] != 0).all(axis=1)
+        self.terminal[index[won | full]] = True
+        return rewards
+
+
+def connect_four_lines():
+    """
+    returns the cells of the 69 groups of four aligned cells of the 6x7
+    board, as flat indices
+    """
+    lines = []
+    for r in range(6):
+        for c in range(7):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                if 0 <= r + 3 * dr < 6 and 0 <= c + 3 * dc < 7:
+                    lines.append([7 * (r + i * dr) + c + i * dc
+                                  for i in range(4)])
+    return np.array(lines)
+
+
+class VecConnectFour(VecGame):
+
+    LINES = connect_four_lines()
+
+    def __init__(self, batch_size):
+        super().__init__(ConnectFour(), batch_size)
+        # number of stones in every column
+        self.heights = np.zeros((batch_size, 7), dtype=np.int64)
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.batch_size, dtype=bool)
+        super().reset(mask)
+        self.heights[mask] = 0
+
+    def legal_mask(self):
+        """
+        returns:
+            mask(np.ndarray): boolean of shape (B, 7), the columns which are
+                not full
+        """
+        return self.heights < 6
+
+    def step(self, actions, active=None):
+        """
+        Args:
+            actions(np.ndarray): one legal action for every board
+            active(np.ndarray - optional): boolean of shape (B,), the boards
+                to play, all the boards which did not end by default
+        returns:
+            rewards(np.ndarray): 1 where the move won the game, 0 elsewhere
+
+        self.boards, self.heights and self.terminal are updated in the
+        process
+        """
+        if active is None:
+            active = ~self.terminal
+        index = np.flatnonzero(active)
+        columns = actions[index]
+        # row 0 is the top of the board
+        rows = 5 - self.heights[index, columns]
+        self.boards[index, rows, columns] = 1
+        self.heights[index, columns] += 1
+
+        rewards = np.zeros(self.batch_size, dtype=np.int64)
+        won = self.wins(self.boards[index].reshape(len(index), 42))
+        rewards[index[won]] = 1
+        full = (self.heights[index] == 6).all(axis=1)
+        self.terminal[index[won | full]] = True
+        return rewards
+
+
+# vectorized version of every game, by name
+VEC_GAMES = {'TicTacToe': VecTicTacToe, 'ConnectFour': VecConnectFour}
@@ -0,0 +1,91 @@
+from functools import partial
+import random
+import time
+from copy import deepcopy
+import numpy as np
+from Games.TicTacToe import TicTacToe, TicTacToeTable
+from Games.ConnectFour import ConnectFour, ConnectFourBitboard
+from Games.Checkers import Checkers
+from GameGlue import GameGlue
+
+
+def sample_states(glue, num_states):
+    """
+    args:
+        glue (GameGlue)
+        num_states (int)
+
+    returns a list of non terminal states visited by random games
+    """
+    states = []
+    while len(states) < num_states:
+        state = glue.starting_state()
+        for t in range(100):
+            legal = glue.legal_actions(state)
+            if state[1] or not legal:
+                break
+            states.append(state)
+            state = glue.next_state(state, random.choice(legal))
+    return states[:num_states]
+
+
+def deepcopy_next_state(glue, rows, action):
+    """
+    args:
+        glue (GameGlue)
+        rows (tuple of tuples) the board as it was stored in the old states
+        action: a legal action
+
+    the transition as it was computed before GameGlue kept a scratch game:
+    deepcopy the game, rebuild the board from the nested tuples, step,
+    invert and convert the board back to nested tuples
+    """
+    game_copy = deepcopy(glue.game)
+    board = []
+    for i in rows:
+        board.append(np.array(i, dtype=np.uint8))
+    game_copy.board = np.array(board, dtype=np.uint8)
+    game_copy.step(action)
+    game_copy.invert_board()
+    return tuple(tuple(i) for i in game_copy.board)
+
+
+def states_per_second(transition, pairs, min_time=1.0):
+    """
+    args:
+        transition (method) called as transition(state, action)
+        pairs (list) of (state, action)
+        min_time (float) minimum number of seconds to run
+
+    returns the number of transitions computed per second
+    """
+    count = 0
+    begin = time.time()
+    while time.time() - begin < min_time:
+        for state, action in pairs:
+            transition(state, action)
+        count += len(pairs)
+    return count / (time.time() - begin)
+
+
+def benchmark(game_interface, num_states=200):
+    glue = GameGlue(game_interface)
+    states = sample_states(glue, num_states)
+
+    pairs = [(S, p) for S in states for p in glue.legal_actions(S)]
+    old_pairs = []
+    for S, p in pairs:
+        glue.scratch.decode(S[2])
+        old_pairs.append((tuple(tuple(i) for i in glue.scratch.board), p))
+
+    before = states_per_second(partial(deepcopy_next_state, glue), old_pairs)
+    after = states_per_second(glue.next_state, pairs)
+    print("{:<22} before: {:>10.0f} states/s   after: {:>10.0f} states/s   x{:.1f}".format(
+        game_interface.__class__.__name__, before, after, after / before))
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    for game_interface in [TicTacToe(), TicTacToeTable(), ConnectFour(),
+                           ConnectFourBitboard(), Checkers()]:
+        benchmark(game_interface)
@@ -0,0 +1,184 @@
+import time
+import numpy as np
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from multiprocessing.sharedctypes import RawArray
+from training import NetTrainer
+
+
+class SharedBuffers():
+    """
+    ring of preallocated slots in shared memory, where a worker writes the
+    boards of its requests and the server writes the predictions
+    """
+
+    def __init__(self, game, slots, max_request):
+        """
+        Args:
+            game: a Game object
+            slots(int): number of requests stored in the ring
+            max_request(int): maximum number of boards in one request
+        """
+        board_shape = (game.num_layers, game.num_rows, game.num_cols)
+        policy_size = len(game.action_space)
+        self.slots = slots
+        self.max_request = max_request
+        self.boards = np.frombuffer(
+            RawArray('B', slots * max_request * int(np.prod(board_shape))),
+            dtype=np.uint8).reshape((slots, max_request) + board_shape)
+        self.values = np.frombuffer(
+            RawArray('f', slots * max_request),
+            dtype=np.float32).reshape(slots, max_request, 1)
+        self.policies = np.frombuffer(
+            RawArray('f', slots * max_request * policy_size),
+            dtype=np.float32).reshape(slots, max_request, policy_size)
+
+
+class InferenceClient():
+    """
+    worker side of the InferenceServer, used by UCT to evaluate positions.
+    Boards and predictions go through shared memory, the pipe carries only
+    the slot and the number of boards of each request.
+    """
+
+    def __init__(self, connection, buffers):
+        self.connection = connection
+        self.buffers = buffers
+        self.slot = 0
+
+    def pred(self, name, new_input):
+        """
+        Args:
+            name(string): name of the network requested by the search, the
+                server evaluates every request with the loaded network
+            new_input: a matrix of shape (k, num_layers, num_rows, num_cols)
+
+        returns:
+            a list [vh_pred, ph_pred] with one row for each of the k boards
+        """
+        buffers = self.buffers
+        k = len(new_input)
+        if k > buffers.max_request:
+            raise ValueError("at most {} boards per request".format(
+                buffers.max_request))
+
+        slot = self.slot
+        self.slot = (slot + 1) % buffers.slots
+        buffers.boards[slot, :k] = new_input
+        self.connection.send((slot, k))
+        if self.connection.recv() is None:
+            raise RuntimeError("no model loaded by the inference server, "
+                               "call InferenceServer.prepare first")
+        return [buffers.values[slot, :k].copy(),
+                buffers.policies[slot, :k].copy()]
+
+
+class InferenceServer(Process):
+    """
+    process that evaluates the positions requested by all the workers with
+    the neural network. The requests pending at the same time are stacked
+    into a single batch, so that the network runs once for all of them.
+    """
+
+    def __init__(self, game, num_clients, max_batch=64, max_wait=0.002,
+                 slots=2, max_request=64):
+        """
+        Args:
+            game: a Game object
+            num_clients(int): number of workers, each gets its own client
+            max_batch(int): maximum number of boards evaluated in one batch
+            max_wait(float): seconds to wait for more requests after the
+                first request of a batch arrived
+            slots(int): size of the shared memory ring of each client
+            max_request(int): maximum number of boards in one request
+        """
+        super().__init__(daemon=True)
+        self.game = game
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        pipes = [Pipe() for i in range(num_clients)]
+        self.connections = [server_end for server_end, client_end in pipes]
+        self.buffers = [SharedBuffers(game, slots, max_request)
+                        for i in range(num_clients)]
+        self.clients = [InferenceClient(client_end, buffers)
+                        for (server_end, client_end), buffers
+                        in zip(pipes, self.buffers)]
+        self.control, self.control_server = Pipe()
+
+    def prepare(self, name):
+        """
+        load a specified model which was previously saved, and wait until
+        the server uses it
+        """
+        self.control.send(('prepare', name))
+        self.control.recv()
+
+    def stop(self):
+        self.control.send(('stop', None))
+        self.join()
+
+    def run(self):
+        # the network lives only in the server process
+        trainer = NetTrainer(self.game)
+        connections = self.connections + [self.control_server]
+        buffers = dict(zip(self.connections, self.buffers))
+
+        while True:
+            requests = []
+            size = 0
+            deadline = None
+            while size < self.max_batch:
+                if deadline is None:
+                    timeout = None
+                else:
+                    timeout = max(deadline - time.time(), 0)
+                ready = wait(connections, timeout)
+                if not ready:
+                    break
+
+                for connection in ready:
+                    if connection is self.control_server:
+                        command, name = connection.recv()
+                        if command == 'stop':
+                            return
+                        trainer.prepare(name)
+                        connection.send(True)
+                    else:
+                        slot, k = connection.recv()
+                        requests.append(
+                            (connection, buffers[connection], slot, k))
+                        size += k
+
+                if requests and deadline is None:
+                    deadline = time.time() + self.max_wait
+
+            self.evaluate(trainer, requests)
+
+    def evaluate(self, trainer, requests):
+        """
+        Args:
+            trainer(NetTrainer)
+            requests(list): tuples (connection, buffers, slot, k)
+
+        runs the network once on all the boards and writes the predictions
+        of every worker back into its own slot. The requests are answered
+        with None while no model is loaded.
+        """
+        if not requests:
+            return
+        if trainer.model is None:
+            for connection, buffers, slot, k in requests:
+                connection.send(None)
+            return
+        batch = np.concatenate([buffers.boards[slot, :k]
+                                for connection, buffers, slot, k in requests])
+        vh_pred, ph_pred = trainer.pred(batch)
+
+        begin = 0
+        for connection, buffers, slot, k in requests:
+            end = begin + k
+            buffers.values[slot, :k] = vh_pred[begin:end]
+            buffers.policies[slot, :k] = ph_pred[begin:end]
+            connection.send(slot)
+            begin = end
@@ -1,9 +1,10 @@
 from functools import partial
 import Games
 import UI
-from Games.TicTacToe import TicTacToe
-from Games.ConnectFour import ConnectFour
+from Games.TicTacToe import TicTacToe, TicTacToeTable
+from Games.ConnectFour import ConnectFour, ConnectFourBitboard
 from Games.Checkers import Checkers
+from Games.VecGames import VEC_GAMES
 from GameGlue import GameGlue
 from UI.GameDisplay import DisplayMain
 import multiprocessing
@@ -17,10 +18,14 @@ from settings import set_mode
 import tensorflow as tf
 from time import sleep
 from training import *
+from inference import InferenceServer
+from nn_numpy import NumpyEvaluator
+from replay import ReplayWriter
+from selfplay import vec_self_play
 import uct
 
 # change the following line to change game
-game_interface = ConnectFour()
+game_interface = ConnectFourBitboard()
 game = GameGlue(game_interface)
 
 
@@ -76,21 +81,19 @@ def manual_move():
     return [action, np.zeros(len(game.action_space))]
 
 
-def ai_move(ai, names, inputs, outputs):
+def ai_move(ai, evaluator):
     """
     args:
         ai (uct object)
-        names (multiprocessing.Manager().Queue)
-        inputs (multiprocessing.Manager().Queue)
-        output (multiprocessing.Manager().Queue)
+        evaluator (inference.InferenceClient)
 
     returns an actions selected by the monte carlo tree search
-    the queues are used to interact with the neural networks
+    the evaluator is used to interact with the neural networks
     """
     global game
     ai.update(game.state)
     #  in evaluation we are taking the greedy action
-    action = ai.get_action(names, inputs, outputs)
+    action = ai.get_action(evaluator)
     policy = ai.policy
     return [action, policy]
 
@@ -120,9 +123,12 @@ def simulation(results, tasks, main_player=random_move, opponent=random_move,
 
     for i in range(n_episodes):
 
-        #  restart the game
+        #  restart the game and the clocks of the players
         game.restart()
+        settings.ai.new_game()
+        settings.ai_old.new_game()
         episode = []
+        states = []
         player = i % 2
 
         while not game.terminal:
@@ -139,6 +145,7 @@ def simulation(results, tasks, main_player=random_move, opponent=random_move,
             if save_episodes:
                 tuple = [game.board, policy, 0]
                 episode.append(tuple)
+                states.append(game.state)
             reward = game.step(action)
 
             #  now will be the turn of the other player
@@ -156,8 +163,22 @@ def simulation(results, tasks, main_player=random_move, opponent=random_move,
             for i in range(len(episode)):
                 episode[len(episode) - i - 1][2] = reward
                 reward = reward * (-1)
+
+            #  exact values of the positions the solver can settle
+            if settings.solver is not None:
+                for position, state in zip(episode, states):
+                    value = settings.solver.value(state)
+                    if value is not None:
+                        position[2] = value
             results.put(episode)
 
+    if settings.solver is not None:
+        settings.solver.save()
+
+    # the processes of the root parallel searches
+    settings.ai.close()
+    settings.ai_old.close()
+
     if evaluation:
         return total_reward, n_episodes
 
@@ -189,7 +210,7 @@ if __name__ == "__main__":
     num_simulations = 4
     total_episodes = 200
 
-    #  modes: 'training', 'manual', 'debug', 'evaluation'
+    #  modes: 'training', 'manual', 'debug', 'evaluation', 'selfplay'
     mode = 'manual'
     set_mode(mode, num_simulations, total_episodes)
 
@@ -205,15 +226,18 @@ if __name__ == "__main__":
     results = manager.Queue()
     scores = manager.Queue()
 
-    command_list = [manager.Queue() for i in range(num_simulations)]
-    input_list = [manager.Queue() for i in range(num_simulations)]
-    output_list = [manager.Queue() for i in range(num_simulations)]
+    # Define the process evaluating the neural network for all workers
+    server = InferenceServer(game_interface, num_simulations)
+    clients = server.clients
+    if settings.local_inference:
+        # every worker evaluates the network itself, the server is not used
+        clients = [NumpyEvaluator() for client in clients]
 
     if mode == 'manual':
         #  testing manually
         tasks.put(1)
         simulation(results, tasks, render=True, main_player=partial(
-            ai_move, ai, command_list[0], input_list[0], output_list[0]), opponent=manual_move, save_episodes=save_episodes)
+            ai_move, ai, clients[0]), opponent=manual_move, save_episodes=save_episodes)
 
     elif mode == 'debug':
 
@@ -227,8 +251,8 @@ if __name__ == "__main__":
         for i in range(num_simulations):
             new_process = multiprocessing.Process(target=simulation, args=(
                 results, tasks, partial(
-                    ai_move, ai, command_list[i], input_list[i], output_list[i]),
-                partial(ai_move, ai_old, command_list[i], input_list[i], output_list[i]), render_game, save_episodes,))
+                    ai_move, ai, clients[i]),
+                partial(ai_move, ai_old, clients[i]), render_game, save_episodes,))
             processes.append(new_process)
             new_process.start()
 
@@ -243,6 +267,7 @@ if __name__ == "__main__":
     elif mode == 'evaluation':
 
         memory = []
+        writer = ReplayWriter(filename, replay_paths(game_interface))
         prev_elo = 0
         # create tasks list
         for i in range(num_simulations):
@@ -253,7 +278,7 @@ if __name__ == "__main__":
         processes = []
         for i in range(num_simulations):
             new_process = multiprocessing.Process(target=elo_rating, args=(
-                results, tasks, scores, prev_elo, partial(ai_move, ai, command_list[i], input_list[i], output_list[i]), random_move, ))
+                results, tasks, scores, prev_elo, partial(ai_move, ai, clients[i]), random_move, ))
             processes.append(new_process)
             new_process.start()
 
@@ -281,17 +306,42 @@ if __name__ == "__main__":
                 elo = elo / num_simulations
                 print('elo:', elo)
 
-                pickle.dump(memory, open(filename, "wb"))
+                writer.append(memory)
+                memory = []
 
             if num_finished_simulations % episode_to_save == 0 and num_finished_simulations > 0:
-                pickle.dump(memory, open(filename, "wb"))
+                writer.append(memory)
+                memory = []
 
         bar.finish()
 
+    elif mode == 'selfplay':
+        #  all the games are played at once on a batch of boards, one
+        #  request to the network per move when it is used
+        if game_interface.name not in VEC_GAMES:
+            print("No vectorized version of", game_interface.name,
+                  "for the selfplay mode.")
+            exit()
+        vec = VEC_GAMES[game_interface.name](64)
+        writer = ReplayWriter(filename)
+        evaluator = None
+        if ai.use_nn:
+            if not settings.local_inference:
+                server.start()
+                server.prepare('new')
+            evaluator = clients[0]
+
+        episodes = vec_self_play(vec, total_episodes, evaluator)
+        writer.append(episodes)
+        print("episodes saved:", len(episodes))
+
     elif mode == 'training':
+        if not settings.local_inference:
+            server.start()
         num_finished_simulations = 0
         training = False
         memory = []
+        writer = ReplayWriter(filename, replay_paths(game_interface))
         prev_elo = 360
         elo = 0
 
@@ -310,36 +360,24 @@ if __name__ == "__main__":
                     for i in range(num_simulations):
                         tasks.put(num_episodes)
 
+                    # the workers query the network through the server,
+                    # which must hold a model before their first request
+                    if ai.use_nn and not settings.local_inference:
+                        server.prepare('new')
+
                     # restart all simulations
                     pool = multiprocessing.Pool(processes=num_simulations)
                     processes = []
                     for i in range(num_simulations):
                         new_process = multiprocessing.Process(target=elo_rating, args=(
                             results, tasks, scores, prev_elo, partial(
-                                ai_move, ai, command_list[i], input_list[i], output_list[i]),
-                            partial(ai_move, ai_old, command_list[i], input_list[i], output_list[i]), ))
+                                ai_move, ai, clients[i]),
+                            partial(ai_move, ai_old, clients[i]), ))
                         processes.append(new_process)
                         new_process.start()
 
-                num_finished_MCTS = 0
-                settings.Trainer.prepare('new')
-                while True:
-                    try:
-                        new_result = results.get(block=False)
-                        break
-                    except:
-                        pass
-
-                    for i in range(len(command_list)):
-                        try:
-                            name = command_list[i].get(block=False)
-                        except:
-                            continue
-                        if name == 'done':
-                            break
-                        new_input = input_list[i].get()
-                        output = settings.Trainer.pred(new_input)
-                        output_list[i].put(output)
+                new_result = results.get()
+
                 # Save in list
                 memory.append(new_result)
                 num_finished_simulations += 1
@@ -355,7 +393,8 @@ if __name__ == "__main__":
                     print('elo:', elo)
 
                     # save memory
-                    pickle.dump(memory, open(filename, "wb"))
+                    writer.append(memory)
+                    memory = []
 
                     # Set process for training the network
                     """
@@ -367,6 +406,7 @@ if __name__ == "__main__":
 
                     settings.Trainer.train('new')
                     ai.use_nn = True
+                    writer.generation += 1
 
                     # reset simulations count
                     num_finished_simulations = 0
@@ -374,7 +414,8 @@ if __name__ == "__main__":
 
                  # save memory every n episodes
                 if num_finished_simulations % episode_to_save == 0 and num_finished_simulations > 0:
-                    pickle.dump(memory, open(filename, "wb"))
+                    writer.append(memory)
+                    memory = []
 
             else:
 
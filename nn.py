@@ -2,9 +2,26 @@
 
 import tensorflow as tf
 import numpy as np
-import math
 import os
 import shutil
+import time
+from nn_numpy import InferenceStats
+
+
+def array_batches(X, V, P, batch_size=100, epochs=1):
+    """
+    args:
+        X, V, P (matrix) as returned by training.load_data_for_training
+        batch_size (int)
+        epochs (int)
+    yields
+        [X, V, P] mini-batches, in a new random order at every epoch
+    """
+    for epoch in range(epochs):
+        perm = np.random.permutation(len(X))
+        for begin in range(0, len(X), batch_size):
+            batch = perm[begin:begin + batch_size]
+            yield [X[batch], V[batch], P[batch]]
 
 
 class NN():
@@ -34,16 +51,19 @@ class NN():
         # Create directory, delete if exsited
         self.create_directory()
 
+        # the inputs and the outputs have fixed names, used by FrozenNN
         self.inputs = tf.placeholder(tf.float32, shape=np.append(
-            None, input_dim).tolist())  # Variable batch size
+            None, input_dim).tolist(), name='inputs')  # Variable batch size
 
-        self.training = tf.placeholder(tf.bool)
+        self.training = tf.placeholder(tf.bool, name='training')
         self.policy_label = tf.placeholder(tf.float32,
                                            shape=np.append(None, policy_head_dim).tolist())
         self.value_label = tf.placeholder(tf.float32, [None, 1])
         self.hidden_layers = self._build_hidden_layers()
         self.value_head = self._build_value_head()
         self.policy_head = self._build_policy_head()
+        tf.identity(self.value_head, name='value')
+        tf.identity(self.policy_head, name='policy')
         self.ce_loss = self._cross_entropy_with_logits()
         self.mse_loss = self._mean_sq_error()
         self.train_op = self.train()
@@ -82,14 +102,14 @@ class NN():
                 hidden_layers.append(first_layer)
 
                 resblk = self.resBlock(first_layer, self.filters,
-                                       True, strides=self.strides, padding=self.padding)
+                                       self.training, strides=self.strides, padding=self.padding)
                 hidden_layers.append(resblk)
 
             if self.num_hidden_layers > 1:
                 for i in range(self.num_hidden_layers-1):
                     with tf.variable_scope('Residual_Block_'+str(i+2)):
                         resblk = self.resBlock(
-                            resblk, self.filters, True, self.strides, self.padding)
+                            resblk, self.filters, self.training, self.strides, self.padding)
                     
                     tf.summary.histogram('residual_block_'+str(i+2), resblk)
 
@@ -251,7 +271,11 @@ class NN():
         else:
             optimizer = tf.train.GradientDescentOptimizer(self.lr)
 
-        apply_gradient_op = optimizer.minimize(self.loss)
+        # the moving statistics of the batch normalizations, used for
+        # inference, are updated at every training step
+        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+        with tf.control_dependencies(update_ops):
+            apply_gradient_op = optimizer.minimize(self.loss)
 
         return apply_gradient_op
 
@@ -264,14 +288,20 @@ class NN():
             batch_size: batch size for training data in every iteration
             epoch: training epochs
             model_saver_path: path for storing model obtained during training process
-            summary_path: path for storing summaries of loss
         """
-        # print(os.getcwd())
+        return self.fit_batches(array_batches(X, v_lab, p_lab, batch_size, epoch),
+                                model_saver_path)
+
+    def fit_batches(self, batches, model_saver_path='/model1/'):
+        """training model on a stream of mini-batches and save
+        Args:
+            batches: iterable of [X, v_lab, p_lab] mini-batches, such as
+                training.stream_data_for_training
+            model_saver_path: path for storing model obtained during training process
+        """
         model_saver_path = os.path.join(os.getcwd(), model_saver_path)
-        # print(model_saver_path)
         if not os.path.exists(model_saver_path):
             os.mkdir(model_saver_path)
-        train_iterations = math.ceil(X.shape[0]*epoch/batch_size)
 
         final_model_saver_path = os.path.join(model_saver_path, 'model.ckpt')
         model_saver_path = os.path.join(model_saver_path, 'model.ckpt')
@@ -281,11 +311,6 @@ class NN():
 
         saver = self.saver
 
-        # if gpu
-        # config = tf.ConfigProto()
-        # config.gpu_options.allow_growth = True
-        # with tf.Session(config=config) as sess:
-
         with tf.Session() as sess:
             # Initialize session.
             sess.run(init)
@@ -294,10 +319,7 @@ class NN():
             summary_writer = tf.summary.FileWriter(
                 'model/summary', graph=sess.graph)
 
-            for step in range(train_iterations):
-                [batch_X, batch_Y, batch_Z] = self.getBatch(
-                    X, step, batch_size, v_lab, p_lab)
-
+            for step, (batch_X, batch_Y, batch_Z) in enumerate(batches):
                 feed_dict = {self.inputs: batch_X,
                              self.value_label: batch_Y,
                              self.policy_label: batch_Z,
@@ -309,12 +331,92 @@ class NN():
                     summary_str = sess.run(summary_op, feed_dict=feed_dict)
                     summary_writer.add_summary(summary_str, step)
 
-                if step % 1000 == 0:  # store model every 1000 iteration times, may be changed due to # of network parameters
+                if step % 1000 == 0:
                     saver.save(sess, model_saver_path, global_step=step)
 
             saver.save(sess, final_model_saver_path)
         return None
 
+    def export(self, model_path='/model1/'):
+        """restore the model saved in model_path and write it with its
+        variables turned into constants to model_path/frozen.pb, which is
+        loaded by FrozenNN
+        Args:
+            model_path: path where the model was saved by fit or fit_batches
+        """
+        with tf.Session(graph=self.inputs.graph) as sess:
+            self.saver.restore(sess, os.path.join(model_path, 'model.ckpt'))
+            graph_def = tf.graph_util.convert_variables_to_constants(
+                sess, sess.graph.as_graph_def(), ['value', 'policy'])
+
+        with tf.gfile.GFile(os.path.join(model_path, 'frozen.pb'), 'wb') as f:
+            f.write(graph_def.SerializeToString())
+
+    def export_weights(self, model_path='/model1/'):
+        """restore the model saved in model_path and write its weights to
+        model_path/weights.npz, which is loaded by nn_numpy.NumpyNN. Every
+        batch normalization is folded into the convolution before it, with
+        the moving statistics used for inference.
+        Args:
+            model_path: path where the model was saved by fit or fit_batches
+        """
+        names = ('kernel', 'bias', 'gamma', 'beta', 'moving_mean',
+                 'moving_variance')
+        variables = [v for v in self.inputs.graph.get_collection(
+            tf.GraphKeys.GLOBAL_VARIABLES)
+            if v.op.name.split('/')[-1] in names]
+        with tf.Session(graph=self.inputs.graph) as sess:
+            self.saver.restore(sess, os.path.join(model_path, 'model.ckpt'))
+            values = sess.run(variables)
+
+        def fold(conv, bn):
+            # the convolution followed by the batch normalization, as a
+            # single convolution
+            kind, kernel, bias = conv
+            kind, gamma, beta, mean, variance = bn
+            scale = gamma / np.sqrt(variance + 1e-5)
+            return kernel * scale, (bias - mean) * scale + beta
+
+        def layers(scope):
+            # the layers of a scope in the order they were created, as
+            # ('conv', kernel, bias), ('dense', kernel, bias) or
+            # ('bn', gamma, beta, moving_mean, moving_variance)
+            found = [(v.op.name.split('/')[-1], value)
+                     for v, value in zip(variables, values)
+                     if v.op.name.startswith(scope + '/')]
+            result = []
+            while found:
+                if found[0][0] == 'kernel':
+                    kind = 'conv' if found[0][1].ndim == 4 else 'dense'
+                    result.append((kind, found[0][1], found[1][1]))
+                    found = found[2:]
+                else:
+                    result.append(('bn',) + tuple(v for n, v in found[:4]))
+                    found = found[4:]
+            return result
+
+        weights = {}
+        for i in range(self.num_hidden_layers):
+            block = layers('Residual_Blocks/Residual_Block_' + str(i + 1))
+            if i == 0:
+                conv, kernel, bias = block.pop(0)
+                weights['first/kernel'] = kernel
+                weights['first/bias'] = bias
+            kernel, bias = fold(*block)
+            weights['block{}/kernel'.format(i)] = kernel
+            weights['block{}/bias'.format(i)] = bias
+
+        for head, scope in (('value', 'Value_head'), ('policy', 'Policy_head')):
+            conv, bn, (dense, kernel_1, bias_1), (dense, kernel_2, bias_2) = \
+                layers(scope)
+            weights[head + '/kernel'], weights[head + '/bias'] = fold(conv, bn)
+            weights[head + '/dense_1/kernel'] = kernel_1
+            weights[head + '/dense_1/bias'] = bias_1
+            weights[head + '/dense_2/kernel'] = kernel_2
+            weights[head + '/dense_2/bias'] = bias_2
+
+        np.savez(os.path.join(model_path, 'weights.npz'), **weights)
+
     def pre_run(self, model_path='/model1/'):
 
         model_saver_path = os.getcwd() + model_path
@@ -343,3 +445,64 @@ class NN():
                                          self.inputs: new_input, self.training: False})
 
         return [vh_pred, ph_pred]
+
+
+class FrozenNN(InferenceStats):
+    """
+    network loaded once from the graph written by NN.export, for inference
+    only. The boards are given as uint8 arrays, cast in the graph, or as
+    float32 arrays. Each call goes through a callable made once by the
+    session instead of a feed_dict, and the latency of the calls is
+    recorded.
+    """
+
+    def __init__(self, frozen_path):
+        """
+        Args:
+            frozen_path: the file written by NN.export
+        """
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(frozen_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        inputs = [node for node in graph_def.node if node.name == 'inputs'][0]
+        shape = tf.TensorShape(inputs.attr['shape'].shape)
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.uint8_inputs = tf.placeholder(tf.uint8, shape=shape)
+            self.float_inputs = tf.cast(self.uint8_inputs, tf.float32)
+            value, policy = tf.import_graph_def(
+                graph_def,
+                input_map={'inputs:0': self.float_inputs,
+                           'training:0': tf.constant(False)},
+                return_elements=['value:0', 'policy:0'],
+                name='frozen')
+        self.graph.finalize()
+
+        self.sess = tf.Session(graph=self.graph)
+        self.run_uint8 = self.sess.make_callable(
+            [value, policy], feed_list=[self.uint8_inputs])
+        # the output of the cast is fed directly with float32 boards
+        self.run_float32 = self.sess.make_callable(
+            [value, policy], feed_list=[self.float_inputs])
+
+    def pred(self, new_input):
+        """
+        args:
+            new_input: a matrix of shape (k, num_layers, num_rows, num_cols),
+                uint8 or float32. It is not copied if it is contiguous.
+
+        returns:
+            a list [vh pred, ph_pred]
+        """
+        begin = time.time()
+        new_input = np.asarray(new_input)
+        if new_input.dtype == np.uint8:
+            vh_pred, ph_pred = self.run_uint8(
+                np.ascontiguousarray(new_input))
+        else:
+            vh_pred, ph_pred = self.run_float32(
+                np.ascontiguousarray(new_input, dtype=np.float32))
+
+        self.record(len(new_input), time.time() - begin)
+        return [vh_pred, ph_pred]
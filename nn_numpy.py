@@ -0,0 +1,167 @@
+# forward pass of the network of nn.py with NumPy only, for the machines
+# evaluating positions on the CPU. It does not import TensorFlow.
+
+import os
+import time
+import numpy as np
+
+
+def conv2d(inputs, kernel, bias):
+    """
+    Args:
+        inputs: tensor of shape (N, C, H, W)
+        kernel: tensor of shape (kh, kw, C, filters), as in TensorFlow
+        bias: tensor of shape (filters,)
+
+    returns the convolution with "same" padding and stride 1, of shape
+    (N, filters, H, W)
+    """
+    kh, kw, channels, filters = kernel.shape
+    n, c, h, w = inputs.shape
+    top = (kh - 1) // 2
+    left = (kw - 1) // 2
+    padded = np.pad(inputs, ((0, 0), (0, 0), (top, kh - 1 - top),
+                             (left, kw - 1 - left)))
+    # the patches are ordered like the kernel: row, column, channel
+    patches = np.stack([padded[:, :, i:i + h, j:j + w]
+                        for i in range(kh) for j in range(kw)], axis=1)
+    patches = patches.transpose(0, 3, 4, 1, 2).reshape(n, h, w, -1)
+    outputs = patches @ kernel.reshape(-1, filters) + bias
+    return outputs.transpose(0, 3, 1, 2)
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def leaky_relu(x, alpha=0.2):
+    return np.where(x > 0, x, alpha * x)
+
+
+class InferenceStats():
+    """
+    counts the calls to pred of a network, see stats. Shared by
+    nn.FrozenNN and NumpyNN.
+    """
+
+    calls = 0
+    positions = 0
+    seconds = 0.0
+
+    def record(self, positions, seconds):
+        self.calls += 1
+        self.positions += positions
+        self.seconds += seconds
+
+    def stats(self):
+        """
+        returns the number of calls and positions evaluated so far, the
+        average latency of a call in milliseconds and the throughput in
+        positions per second
+        """
+        return {'calls': self.calls,
+                'positions': self.positions,
+                'latency_ms': 1000 * self.seconds / max(self.calls, 1),
+                'positions_per_second': self.positions / max(self.seconds, 1e-9)}
+
+
+class NumpyNN(InferenceStats):
+    """
+    network of nn.NN evaluated with NumPy, from the weights written by
+    NN.export_weights, where the batch normalizations are folded into the
+    convolutions. pred gives the same outputs as NN.pred.
+    """
+
+    def __init__(self, weights_path):
+        """
+        Args:
+            weights_path: the file written by NN.export_weights
+        """
+        with np.load(weights_path) as f:
+            self.weights = {name: f[name].astype(np.float32) for name in f}
+        self.num_blocks = len([name for name in self.weights
+                               if name.startswith('block')
+                               and name.endswith('/kernel')])
+    def head(self, hidden, name, activation):
+        w = self.weights
+        x = relu(conv2d(hidden, w[name + '/kernel'], w[name + '/bias']))
+        x = x.reshape(len(x), -1)
+        x = leaky_relu(x @ w[name + '/dense_1/kernel'] + w[name + '/dense_1/bias'])
+        x = x @ w[name + '/dense_2/kernel'] + w[name + '/dense_2/bias']
+        return activation(x)
+
+    def pred(self, new_input):
+        """
+        args:
+            new_input: a matrix of shape (k, num_layers, num_rows, num_cols)
+
+        returns:
+            a list [vh pred, ph_pred]
+        """
+        begin = time.time()
+        w = self.weights
+        x = conv2d(np.asarray(new_input, dtype=np.float32),
+                   w['first/kernel'], w['first/bias'])
+        for i in range(self.num_blocks):
+            block = 'block{}/'.format(i)
+            x = conv2d(x, w[block + 'kernel'], w[block + 'bias']) + relu(x)
+
+        vh_pred = self.head(x, 'value', np.tanh)
+        ph_pred = self.head(x, 'policy', lambda logits: logits)
+
+        self.record(len(new_input), time.time() - begin)
+        return [vh_pred, ph_pred]
+
+
+class NumpyEvaluator():
+    """
+    evaluator for UCT running the networks in the worker process itself,
+    with the method pred(name, new_input) of inference.InferenceClient.
+    The weights are loaded again when NN.export_weights rewrites them,
+    which is checked at most once every check_interval seconds.
+    """
+
+    def __init__(self, paths=None, check_interval=10.0):
+        """
+        Args:
+            paths(dict - optional): directory of the model of every name
+            check_interval(float): seconds between two checks for new
+                weights of a model
+        """
+        if paths is None:
+            paths = {'old': 'model/checkpoint/old/',
+                     'new': 'model/checkpoint/new/'}
+        self.paths = paths
+        self.check_interval = check_interval
+        # name -> (modification time, time of the last check, NumpyNN)
+        self.models = {}
+
+    def refresh(self, name=None):
+        """
+        checks for new weights at the next evaluation of a model, or of all
+        the models when no name is given
+        """
+        for other in ([name] if name is not None else list(self.models)):
+            if other in self.models:
+                modified, checked, model = self.models[other]
+                self.models[other] = (modified, -np.inf, model)
+
+    def model(self, name):
+        entry = self.models.get(name)
+        now = time.time()
+        if entry is not None and now - entry[1] < self.check_interval:
+            return entry[2]
+
+        weights_path = os.path.join(self.paths[name], 'weights.npz')
+        if not os.path.isfile(weights_path):
+            raise FileNotFoundError(
+                "{} not found, the weights are written by NetTrainer.train "
+                "or NN.export_weights".format(weights_path))
+        modified = os.path.getmtime(weights_path)
+        if entry is None or entry[0] != modified:
+            entry = (modified, now, NumpyNN(weights_path))
+        self.models[name] = (modified, now, entry[2])
+        return entry[2]
+
+    def pred(self, name, new_input):
+        return self.model(name).pred(new_input)
@@ -0,0 +1,216 @@
+import os
+import time
+import numpy as np
+
+COLUMNS = ('boards', 'values', 'policies')
+
+
+def shard_path(path, shard, column):
+    return os.path.join(path, '{:05d}-{}.npy'.format(shard, column))
+
+
+def read_index(path):
+    """
+    args:
+        path (string) directory of a replay buffer
+
+    returns the list of (shard, number of positions, generation, time)
+    of the shards written so far
+    """
+    index = []
+    try:
+        with open(os.path.join(path, 'index.txt')) as f:
+            for line in f:
+                shard, size, generation, created = line.split()
+                index.append((int(shard), int(size), int(generation),
+                              float(created)))
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def last_generation(indexes):
+    """
+    args:
+        indexes (iterable) of indices returned by read_index
+
+    returns the most recent generation found in any of them, 0 if they are
+    all empty
+    """
+    return max((generation for index in indexes
+                for shard, size, generation, created in index), default=0)
+
+
+def window(paths, max_positions=None, max_generations=None):
+    """
+    args:
+        paths (list) directories written by ReplayWriter
+        max_positions (int - optional) number of positions to keep
+        max_generations (int - optional) number of generations to keep
+
+    returns the (path, shard, size) of the most recent shards, from the
+    oldest to the newest, holding at most max_positions positions and
+    coming from the last max_generations generations of all the directories
+    """
+    indexes = [(path, read_index(path)) for path in paths]
+    last = last_generation(index for path, index in indexes)
+    shards = []
+    for path, index in indexes:
+        for shard, size, generation, created in index:
+            if max_generations is None or last - generation < max_generations:
+                shards.append((created, path, shard, size))
+    shards.sort()
+
+    kept = []
+    total = 0
+    for created, path, shard, size in reversed(shards):
+        if max_positions is not None and total + size > max_positions and kept:
+            break
+        kept.append((path, shard, size))
+        total += size
+    return kept[::-1]
+
+
+def evict(paths, max_positions=None, max_generations=None):
+    """
+    args:
+        paths (list) directories written by ReplayWriter
+        max_positions (int - optional)
+        max_generations (int - optional)
+
+    deletes the shards outside of the window, see window
+    """
+    kept = set((path, shard)
+               for path, shard, size in window(paths, max_positions,
+                                               max_generations))
+    for path in paths:
+        index = read_index(path)
+        remaining = [entry for entry in index if (path, entry[0]) in kept]
+        if len(remaining) == len(index):
+            continue
+
+        # the index is replaced first, so that it never lists a deleted shard
+        tmp = os.path.join(path, 'index.tmp')
+        with open(tmp, 'w') as f:
+            for entry in remaining:
+                f.write('{} {} {} {}\n'.format(*entry))
+        os.replace(tmp, os.path.join(path, 'index.txt'))
+        for entry in index:
+            if (path, entry[0]) not in kept:
+                for column in COLUMNS:
+                    os.remove(shard_path(path, entry[0], column))
+
+
+def episodes_to_columns(episodes):
+    """
+    args:
+        episodes (list) of episodes, each a list of [board, policy, value]
+    returns
+        boards (np.ndarray) uint8 boards of shape (N, num_rows, num_cols)
+        values (np.ndarray) float32 outcomes of shape (N, 1)
+        policies (np.ndarray) float32 policies of shape (N, policy size)
+    """
+    positions = [position for episode in episodes for position in episode]
+    boards = np.array([board for board, policy, value in positions],
+                      dtype=np.uint8)
+    values = np.array([[value] for board, policy, value in positions],
+                      dtype=np.float32)
+    policies = np.array([policy for board, policy, value in positions],
+                        dtype=np.float32)
+    return boards, values, policies
+
+
+class ReplayWriter():
+    """
+    writes self-play episodes to a directory, appending every batch of
+    episodes as a new shard made of one .npy file per column. Shards are
+    never rewritten, and index.txt lists the complete shards with the
+    generation (training iteration) of the network that played them.
+    """
+
+    def __init__(self, path, paths=()):
+        """
+        Args:
+            path(string): directory of the replay buffer, created if needed
+            paths(list - optional): the other replay directories of the
+                game. The generation continues from the most recent one of
+                all the directories, so that window can compare the
+                generations of different runs.
+        """
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        index = read_index(path)
+        self.shard = index[-1][0] + 1 if index else 0
+        self.generation = last_generation(
+            [index] + [read_index(other) for other in paths])
+
+    def append(self, episodes):
+        """
+        Args:
+            episodes(list): episodes, each a list of [board, policy, value]
+        """
+        if not episodes:
+            return
+        columns = episodes_to_columns(episodes)
+        for column, data in zip(COLUMNS, columns):
+            np.save(shard_path(self.path, self.shard, column), data)
+
+        # the shard is listed only once all its columns are on disk
+        with open(os.path.join(self.path, 'index.txt'), 'a') as f:
+            f.write('{} {} {} {}\n'.format(self.shard, len(columns[0]),
+                                            self.generation, time.time()))
+        self.shard += 1
+
+
+class ReplayBuffer():
+    """
+    memory-mapped view of the shards of one or more replay directories
+    """
+
+    def __init__(self, paths, max_positions=None, max_generations=None):
+        """
+        Args:
+            paths(list): directories written by ReplayWriter
+            max_positions(int - optional): keep only the most recent shards
+                holding at most this many positions
+            max_generations(int - optional): keep only the shards of the
+                last generations of all the directories
+        """
+        self.shards = []
+        for path, shard, size in window(paths, max_positions, max_generations):
+            self.shards.append(tuple(
+                np.load(shard_path(path, shard, column), mmap_mode='r')
+                for column in COLUMNS))
+        sizes = [len(boards) for boards, values, policies in self.shards]
+        self.offsets = np.cumsum([0] + sizes)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def sample(self, batch_size):
+        """
+        Args:
+            batch_size(int)
+        returns
+            boards, values, policies of batch_size positions drawn uniformly
+        """
+        return self.gather(np.random.randint(len(self), size=batch_size))
+
+    def gather(self, positions):
+        """
+        Args:
+            positions(np.ndarray): global indices of positions
+        returns
+            boards, values, policies of the positions, in the same order
+        """
+        positions = np.asarray(positions)
+        shards = np.searchsorted(self.offsets, positions, side='right') - 1
+        result = [np.empty((len(positions),) + column.shape[1:], column.dtype)
+                  for column in self.shards[0]]
+        for shard in np.unique(shards):
+            mask = shards == shard
+            rows = positions[mask] - self.offsets[shard]
+            for out, column in zip(result, self.shards[shard]):
+                out[mask] = column[rows]
+        return result
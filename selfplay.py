@@ -0,0 +1,84 @@
+import numpy as np
+
+
+def sample_actions(priors):
+    """
+    Args:
+        priors(np.ndarray): probabilities of shape (N, num_actions), every
+            row summing to 1
+    returns:
+        actions(np.ndarray): one action drawn from every row
+    """
+    cumulative = priors.cumsum(axis=1)
+    draws = np.random.random(len(priors)) * cumulative[:, -1]
+    return (cumulative <= draws[:, np.newaxis]).sum(axis=1)
+
+
+def vec_self_play(vec, num_games, evaluator=None, name='new'):
+    """
+    Args:
+        vec(VecGame): the boards on which the games are played
+        num_games(int): number of games to play
+        evaluator (optional): object with a method pred(name, new_input),
+            such as an InferenceClient or a NumpyEvaluator. The moves are
+            drawn from its policy head, or uniformly at random without
+            evaluator.
+        name(string): name of the network requested from the evaluator
+
+    plays the games on all the boards of vec at once, restarting every
+    board whose game ended until num_games games were played. All the
+    boards are evaluated with a single request per ply.
+
+    returns the episodes, each a list of [board, policy, value] as saved
+    by main.simulation. The policies are the priors the moves were drawn
+    from, not the visit counts of a search, so these episodes must not be
+    mixed with the training data of UCT.
+    """
+    batch_size = vec.batch_size
+    vec.reset()
+    active = np.arange(batch_size) < num_games
+    started = int(active.sum())
+    running = [[] for b in range(batch_size)]
+    episodes = []
+
+    while active.any():
+        index = np.flatnonzero(active)
+        mask = vec.legal_mask()[index]
+        if evaluator is None:
+            priors = mask.astype(np.float64)
+        else:
+            vh_pred, ph_pred = evaluator.pred(name, vec.layers()[index])
+            # the policy head is trained with a sigmoid per action
+            priors = mask / (1 + np.exp(-np.asarray(ph_pred, np.float64)))
+        priors /= priors.sum(axis=1, keepdims=True)
+        policies = np.where(mask, priors, -1)
+
+        actions = np.zeros(batch_size, dtype=np.int64)
+        actions[index] = sample_actions(priors)
+        for i, b in enumerate(index):
+            running[b].append([vec.boards[b].copy(), policies[i], 0])
+        rewards = vec.step(actions, active)
+        vec.invert_board()
+
+        ended = np.flatnonzero(active & vec.terminal)
+        for b in ended:
+            # backpropagate the reward
+            reward = rewards[b]
+            episode = running[b]
+            for i in range(len(episode)):
+                episode[len(episode) - i - 1][2] = reward
+                reward = reward * (-1)
+            episodes.append(episode)
+            running[b] = []
+
+        # start the remaining games on the boards which are free
+        restart = ended[:max(num_games - started, 0)]
+        active[ended] = False
+        if len(restart):
+            reset = np.zeros(batch_size, dtype=bool)
+            reset[restart] = True
+            vec.reset(reset)
+            active[restart] = True
+            started += len(restart)
+
+    return episodes
@@ -3,6 +3,8 @@ from training import training_nn
 import numpy as np
 from uct import UCTValues
 from GameGlue import GameGlue
+from solver import Solver
+import multiprocessing
 import os
 from time import strftime, gmtime
 from os import path
@@ -13,11 +15,29 @@ def init(game_interface):
     global ai
     global ai_old
     global name_game
+    global solver
+    global local_inference
 
     name_game = game_interface.name
-    Trainer = NetTrainer(game_interface)
-    ai = UCTValues(GameGlue(game_interface))
-    ai_old = UCTValues(GameGlue(game_interface))
+    # train on the most recent self-play positions only
+    Trainer = NetTrainer(game_interface, max_positions=100000)
+
+    # exact outcomes of the end of the games whose board fills up. The
+    # name must not start with the name of the game, or the tablebase would
+    # be read as episodes by training.find. The states are keyed by the
+    # engine, so every engine of a game has its own tablebase.
+    solver = None
+    if name_game in ('TicTacToe', 'ConnectFour'):
+        engine = type(game_interface).__name__
+        solver = Solver(GameGlue(game_interface),
+                        path=path.join('saved', 'tablebase-' + engine + '.pkl'))
+
+    # evaluate the network in every worker with NumPy (nn_numpy) instead
+    # of sending the positions to the inference server
+    local_inference = False
+
+    ai = UCTValues(GameGlue(game_interface), solver=solver)
+    ai_old = UCTValues(GameGlue(game_interface), solver=solver)
 
 
 def set_mode(mode, num_simulations, total_episodes):
@@ -59,6 +79,8 @@ def set_mode(mode, num_simulations, total_episodes):
         render_game = True
         save_episodes = False
         ai.DEBUG = False
+        # search every move on all the cores
+        ai.workers = multiprocessing.cpu_count()
 
         print("Mode: manual.")
 
@@ -78,11 +100,24 @@ def set_mode(mode, num_simulations, total_episodes):
         render_game = False
         save_episodes = True
         ai.DEBUG = False
+        # share the cores between the games played in parallel
+        ai.workers = max(1, multiprocessing.cpu_count() // num_simulations)
 
         print("Mode: evaluation")
         print("Parallel simulations:", num_simulations)
         print("Total number of episodes:", total_episodes)
 
+    elif mode == 'selfplay':
+        render_game = False
+        save_episodes = True
+        ai.DEBUG = False
+        # the policies are not improved by a search, the prefix keeps the
+        # episodes out of the training data found by training.find
+        filename = path.join('saved', 'selfplay-' + generated_name)
+
+        print("Mode: selfplay")
+        print("Total number of episodes:", total_episodes)
+
     else:
         print("mode name not recognized.")
         exit()
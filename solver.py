@@ -0,0 +1,101 @@
+import fcntl
+import os
+import pickle
+import numpy as np
+
+
+class Solver():
+    """
+    exact solver for the positions close to the end of games whose board
+    fills up (TicTacToe, ConnectFour). Positions are solved by negamax and
+    their outcomes are kept in a tablebase indexed by state key, which can
+    be saved to disk and loaded again.
+    """
+
+    def __init__(self, glue, max_empty=12, path=None):
+        """
+        Args:
+            glue(GameGlue): the game whose states are solved
+            max_empty(int): only positions with at most this many empty
+                cells are solved
+            path(string - optional): file of the tablebase, loaded if it
+                exists. The keys of the states depend on the engine of the
+                game, so a tablebase must only be used by the engine which
+                wrote it.
+        """
+        self.glue = glue
+        self.max_empty = max_empty
+        self.path = path
+        self.table = {}
+        if path is not None and os.path.isfile(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.table)
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            self.table.update(pickle.load(f))
+
+    def save(self):
+        """
+        writes the tablebase, merged with the one already on disk (other
+        processes may have saved their own positions). The merge holds a
+        lock on path.lock, so that processes saving at the same time do not
+        drop the positions of each other.
+        """
+        if self.path is None:
+            return
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            table = dict(self.table)
+            if os.path.isfile(self.path):
+                with open(self.path, 'rb') as f:
+                    table.update(pickle.load(f))
+            tmp = self.path + '.tmp{}'.format(os.getpid())
+            with open(tmp, 'wb') as f:
+                pickle.dump(table, f)
+            os.replace(tmp, self.path)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def empty_cells(self, state):
+        game = self.glue.scratch
+        game.decode(state[2])
+        return int(np.count_nonzero(game.board == 0))
+
+    def value(self, state):
+        """
+        Args:
+            state(tuple): a GameGlue state which is not the end of the game
+
+        returns the outcome of the position with perfect play, from the
+        perspective of the player to move: 1 win, 0 draw, -1 loss. None if
+        the position has too many empty cells to be solved.
+        """
+        value = self.table.get(state[3])
+        if value is not None:
+            return value
+        if self.empty_cells(state) > self.max_empty:
+            return None
+        return self.negamax(state)
+
+    def negamax(self, state):
+        value = self.table.get(state[3])
+        if value is not None:
+            return value
+
+        glue = self.glue
+        legal = glue.legal_actions(state)
+        best = -1 if legal else 0
+        for action in legal:
+            S = glue.next_state(state, action)
+            if S[1]:
+                value = glue.win_values(S) or 0
+            else:
+                value = -self.negamax(S)
+            if value > best:
+                best = value
+                if best == 1:
+                    break
+        self.table[state[3]] = best
+        return best
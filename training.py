@@ -1,4 +1,5 @@
 import fnmatch
+from collections import OrderedDict
 import os
 import pickle
 import tensorflow as tf
@@ -6,7 +7,9 @@ from nn import *
 from Games.Games import Game
 from Games.TicTacToe import *
 from Games.ConnectFour import *
-from nn import NN
+from nn import NN, FrozenNN, array_batches
+from nn_numpy import NumpyNN
+from replay import ReplayBuffer, episodes_to_columns, evict
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
@@ -26,77 +29,257 @@ def find(pattern, path):
     return result
 
 
+def load_file(path):
+    """
+    args:
+        path (string)
+
+    returns the list of episodes saved in a file, None if it cannot be read
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)  # load the data from file
+    except:
+        print("Data not found in ", path)
+        return None
+
+
+def load_columns(path):
+    """
+    args:
+        path (string) a pickled list of episodes or a replay directory
+
+    returns a list of (boards, values, policies) column triples
+    """
+    if os.path.isdir(path):
+        return ReplayBuffer([path]).shards
+    data = load_file(path)
+    if not data or not isinstance(data, list):
+        # not a list of episodes
+        return []
+    return [episodes_to_columns(data)]
+
+
+def columns_to_arrays(game, columns):
+    """
+    args:
+        game (Games)
+        columns (list) of (boards, values, policies) column triples
+    returns
+        X (matrix) board, input for the neural network
+        V (matrix) final outcome of each game
+        P (matrix) vector of values from MCTS child nodes
+
+    the positions are counted first, so that every array is allocated once
+    """
+    size = sum(len(boards) for boards, values, policies in columns)
+    X = np.empty((size, game.num_layers, game.num_rows, game.num_cols),
+                 dtype=np.float32)
+    V = np.empty((size, 1), dtype=np.float32)
+    P = np.empty((size, len(game.action_space)), dtype=np.float32)
+
+    i = 0
+    for boards, values, policies in columns:
+        # the boards are converted to their one-hot representation
+        X[i:i + len(boards)] = game.encode_boards(boards)
+        V[i:i + len(boards)] = values
+        P[i:i + len(boards)] = policies
+        i += len(boards)
+    return [X, V, P]
+
+
 def load_data_for_training(game):
     """
     args:
         game (Games)
     returns 
         X (matrix) board, input for the neural network
-        P (matrix) vector of values from MCTS child nodes
         V (matrix) final outcome of each game
+        P (matrix) vector of values from MCTS child nodes
+
+    reads both pickled files and replay directories
     """
 
     mypath = 'saved'
     # list of files
     files = find(game.name + '*', mypath)
 
-    # where input (board state) will be saved
-    X = np.empty((0, game.num_layers, game.num_rows, game.num_cols))
-    V = np.empty((0, 1))  # where the value (one of labels) will be saved
-    # where the policy (one of the labels) will be saved
-    P = np.empty((0, len(game.action_space)))
-
+    columns = []
     for file in files:
         print(file)
-        try:
-            data = pickle.load(open(os.path.join(mypath,file), "rb")
-                               )  # load the data from file
-        except:
-            print("Data not found in ", file)
+        file_columns = load_columns(os.path.join(mypath, file))
+        if not file_columns:
             continue
-
-        X_file = np.empty((0, game.num_layers, game.num_rows, game.num_cols))
-        V_file = np.empty((0, 1))
-        P_file = np.empty((0, len(game.action_space)))
-        for episode in data:
-            X_episode = np.empty(
-                (len(episode), game.num_layers, game.num_rows, game.num_cols))
-            V_episode = np.empty((len(episode), 1))
-            P_episode = np.empty((len(episode), len(game.action_space)))
-            for i in range(len(episode)):
-                game.board = episode[i][0]
-                # the board is converted to its one-hot representation
-                X_episode[i] = game.layers()
-                P_episode[i] = episode[i][1]
-                V_episode[i] = episode[i][2]
-
-            X_file = np.append(X_file, X_episode, axis=0)
-            V_file = np.append(V_file, V_episode, axis=0)
-            P_file = np.append(P_file, P_episode, axis=0)
-
-        X = np.append(X, X_file, axis=0)
-        V = np.append(V, V_file, axis=0)
-        P = np.append(P, P_file, axis=0)
+        columns.extend(file_columns)
         print("Correctly loaded: ", file)
 
+    X, V, P = columns_to_arrays(game, columns)
     print("Episodes in data_set:", len(V))
     return [X, V, P]
 
 
-def training_nn(game, nnet, model_path):
+def stream_data_for_training(game, batch_size=100, epochs=1):
+    """
+    args:
+        game (Games)
+        batch_size (int)
+        epochs (int) number of passes over the files
+    yields
+        [X, V, P] mini-batches, as returned by load_data_for_training
+
+    only one file or shard is held in memory at a time, so the data set can
+    be larger than the memory. Files are visited in random order and the
+    positions of each file are shuffled.
+    """
+    mypath = 'saved'
+    files = find(game.name + '*', mypath)
+
+    for epoch in range(epochs):
+        np.random.shuffle(files)
+        for file in files:
+            for shard in load_columns(os.path.join(mypath, file)):
+                X, V, P = columns_to_arrays(game, [shard])
+                perm = np.random.permutation(len(X))
+                for begin in range(0, len(X), batch_size):
+                    batch = perm[begin:begin + batch_size]
+                    yield [X[batch], V[batch], P[batch]]
+
+
+def augment_batches(game, batches):
+    """
+    args:
+        game (Games)
+        batches (iterable) of [X, V, P] mini-batches
+    yields
+        the mini-batches, where every position is transformed by a random
+        symmetry of the game. Values do not change under a symmetry.
+    """
+    board_perms, policy_perms = game.symmetries()
+    for X, V, P in batches:
+        if len(board_perms) > 1:
+            s = np.random.randint(len(board_perms), size=len(X))
+            cells = X.reshape(len(X), game.num_layers, -1)
+            X = np.take_along_axis(
+                cells, board_perms[s][:, np.newaxis], axis=2).reshape(X.shape)
+            P = np.take_along_axis(P, policy_perms[s], axis=1)
+        yield [X, V, P]
+
+
+def replay_paths(game):
+    """
+    args:
+        game (Games)
+
+    returns the replay directories of a game in the saved folder
+    """
+    mypath = 'saved'
+    paths = [os.path.join(mypath, file)
+             for file in find(game.name + '*', mypath)]
+    return [path for path in paths if os.path.isdir(path)]
+
+
+def sample_data_for_training(game, batch_size=100, num_batches=1000,
+                             max_positions=None, max_generations=None):
+    """
+    args:
+        game (Games)
+        batch_size (int)
+        num_batches (int) number of mini-batches to yield
+        max_positions (int - optional) size of the window of recent positions
+        max_generations (int - optional) number of recent generations
+    yields
+        [X, V, P] mini-batches sampled uniformly from the window of the
+        replay directories, as returned by load_data_for_training
+    """
+    buffer = ReplayBuffer(replay_paths(game), max_positions, max_generations)
+    print("Positions in replay window:", len(buffer))
+    if not len(buffer):
+        return
+    for i in range(num_batches):
+        yield columns_to_arrays(game, [buffer.sample(batch_size)])
+
+
+def training_nn(game, nnet, model_path, stream=False, max_positions=None,
+                max_generations=None, num_batches=1000, augment=True):
     """
     Args:
         game: a Game object
         nnet: a NN object
+        stream(bool): read the data one file at a time while training
+        max_positions(int - optional): train on a fixed number of
+            mini-batches sampled from the most recent positions, and delete
+            the older shards
+        max_generations(int - optional): same, keeping the positions of the
+            most recent generations
+        num_batches(int): mini-batches per training step with a window
+        augment(bool): transform every position by a random symmetry of
+            the game
+    """
+    if max_positions is not None or max_generations is not None:
+        evict(replay_paths(game), max_positions, max_generations)
+        batches = sample_data_for_training(
+            game, 100, num_batches, max_positions, max_generations)
+    elif stream:
+        batches = stream_data_for_training(game, 100, 1000)
+    else:
+        X, V, P = load_data_for_training(game)
+        assert len(X) == len(V)
+        batches = array_batches(X, V, P, 100, 1000)
+
+    if augment:
+        batches = augment_batches(game, batches)
+    nnet.fit_batches(batches, model_path)
+
+
+class EvaluationCache():
     """
-    X, V, P = load_data_for_training(game)
-    assert len(X) == len(V)
-    perm = np.random.permutation(len(X))
-    X = X[perm]
-    V = V[perm]
-    P = P[perm]
+    bounded least recently used cache of the predictions of the network,
+    indexed by the positions they were computed for. The network evaluates
+    with the moving statistics of its batch normalizations, so that a
+    prediction does not depend on the other positions of the batch.
+    """
+
+    def __init__(self, capacity=100000):
+        """
+        Args:
+            capacity(int): maximum number of positions kept
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    nnet.fit(X, V, P, 100, 1000, model_path)
+    @staticmethod
+    def key(layers):
+        """
+        Args:
+            layers: the one-hot layers representation of a board
+        returns the layers packed into bytes, one bit per cell
+        """
+        return np.packbits(np.asarray(layers) != 0).tobytes()
+
+    def get(self, key):
+        """
+        returns the cached (value, policy) of a key, None on a miss
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
 
 
 class NetTrainer():
@@ -104,17 +287,33 @@ class NetTrainer():
     manages the two neural networks (older and newest)
     """
 
-    def __init__(self, game, residual_layers=5):
+    def __init__(self, game, residual_layers=5, max_positions=None,
+                 max_generations=None, cache_size=100000,
+                 backend='tensorflow'):
         """
         Args:
             game: A Game object
             residual_layers(int): number of residual layers. Default is 5
+            max_positions(int - optional): size of the replay window in
+                positions, see training_nn
+            max_generations(int - optional): size of the replay window in
+                generations, see training_nn
+            cache_size(int): number of predictions kept by pred, 0 to
+                disable the cache
+            backend(string): 'tensorflow' to evaluate the frozen graph, or
+                'numpy' to evaluate the exported weights with NumPy only
         """
         self.game = game
+        self.cache = EvaluationCache(cache_size) if cache_size else None
+        self.max_positions = max_positions
+        self.max_generations = max_generations
+        self.backend = backend
         input_shape = game.layers().shape
         policy_shape = len(game.action_space)
 
         self.nnet = NN(input_shape, residual_layers, policy_shape, True)
+        # network used by pred, loaded by prepare
+        self.model = None
         self.path_1 = 'model/checkpoint/old/'
         self.path_2 = 'model/checkpoint/new/'
 
@@ -123,34 +322,82 @@ class NetTrainer():
         Args:
             name(string): 'new' or 'old'
 
-        trains a specified neural network
+        trains a specified neural network, and exports its weights for
+        nn_numpy
         """
         if name == 'old':
-            training_nn(self.game, self.nnet, self.path_1)
+            model_path = self.path_1
         elif name == 'new':
-            training_nn(self.game, self.nnet, self.path_2)
+            model_path = self.path_2
         else:
             print("invalid name.")
+            return
+        training_nn(self.game, self.nnet, model_path,
+                    max_positions=self.max_positions,
+                    max_generations=self.max_generations)
+        # the weights evaluated by nn_numpy, without TensorFlow
+        self.nnet.export_weights(model_path)
 
     def prepare(self, name):
         """
         load a specified model which was previously saved
         """
+        # predictions of the previous model are no longer valid
+        if self.cache is not None:
+            self.cache.clear()
         if name == 'old':
-            self.nnet.pre_run(self.path_1)
+            self.model = self.load(self.path_1)
         elif name == 'new':
-            self.nnet.pre_run(self.path_2)
+            self.model = self.load(self.path_2)
         else:
             print("invalid name.")
 
+    def load(self, model_path):
+        """
+        Args:
+            model_path(string): directory of a saved model
+
+        returns the model as a FrozenNN, or as a NumpyNN with the numpy
+        backend, exported again if the checkpoint is more recent than the
+        exported file
+        """
+        checkpoint = os.path.join(model_path, 'model.ckpt.index')
+        if self.backend == 'numpy':
+            weights_path = os.path.join(model_path, 'weights.npz')
+            if not os.path.isfile(weights_path) or \
+                    os.path.getmtime(weights_path) < os.path.getmtime(checkpoint):
+                self.nnet.export_weights(model_path)
+            return NumpyNN(weights_path)
+
+        frozen_path = os.path.join(model_path, 'frozen.pb')
+        if not os.path.isfile(frozen_path) or \
+                os.path.getmtime(frozen_path) < os.path.getmtime(checkpoint):
+            self.nnet.export(model_path)
+        return FrozenNN(frozen_path)
+
     def pred(self, new_input):
         """
         Args:
             new_input: a layers representation
 
         returns the predtion generated by the neural network
+
+        positions found in the cache are not evaluated again
         """
-        return self.nnet.pred(new_input)
+        if self.cache is None:
+            return self.model.pred(new_input)
+
+        new_input = np.asarray(new_input)
+        keys = [self.cache.key(layers) for layers in new_input]
+        entries = [self.cache.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if missing:
+            vh_pred, ph_pred = self.model.pred(new_input[missing])
+            for j, i in enumerate(missing):
+                entries[i] = (vh_pred[j], ph_pred[j])
+                self.cache.put(keys[i], entries[i])
+        return [np.array([vh for vh, ph in entries]),
+                np.array([ph for vh, ph in entries])]
 
 
 if __name__ == "__main__":
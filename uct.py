@@ -1,23 +1,238 @@
 from __future__ import division
+import copy
+import multiprocessing
 import numpy as np
+import random
 import time
-from math import log, sqrt
 from random import choice
 
 
-class Stat(object):
-    __slots__ = ('value', 'visits')
+class Tree(object):
+    """
+    Search statistics stored in contiguous arrays.
+
+    Node i is the position with state states[i]. visits[i] and value[i]
+    are its number of visits and the sum of the results backed up through
+    it, from the perspective of the player who moved into it. Its children
+    are the nodes children[first[i]:first[i] + count[i]], reached with the
+    actions actions[first[i]:first[i] + count[i]] with prior probabilities
+    prior[first[i]:first[i] + count[i]]. A node that was not expanded yet
+    has first[i] == -1. proven[i] is the exact outcome of the node (1, 0
+    or -1 from the same perspective as value[i]) once it is proven by the
+    solver, NaN before.
+
+    Nodes are indexed by state key, so a position reached through different
+    paths is stored only once.
+    """
+
+    def __init__(self, capacity=1024):
+        self.index = {}
+        self.states = []
+        self.actions = []
+        self.num_nodes = 0
+        self.num_edges = 0
+
+        # node arrays
+        self.visits = np.zeros(capacity)
+        self.value = np.zeros(capacity)
+        self.first = np.full(capacity, -1, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.proven = np.full(capacity, np.nan)
+
+        # edge arrays
+        self.children = np.zeros(capacity, dtype=np.int64)
+        self.prior = np.zeros(capacity)
+
+    def __len__(self):
+        return self.num_nodes
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def clear(self):
+        self.__init__(len(self.visits))
+
+    def reroot(self, key):
+        """
+        Args:
+            key(int): state key of the new root
+
+        keeps only the nodes that can be reached from the new root, which
+        becomes node 0. The tree is cleared if the key is not in the tree.
+        """
+        root = self.index.get(key)
+        if root is None:
+            self.clear()
+            return
+
+        # breadth first numbering of the nodes reachable from the root
+        order = [root]
+        number = {root: 0}
+        for node in order:
+            if self.first[node] < 0:
+                continue
+            for kid in self.children[self.edges(node)].tolist():
+                if kid not in number:
+                    number[kid] = len(order)
+                    order.append(kid)
+        nodes = np.array(order, dtype=np.int64)
+        lookup = np.full(self.num_nodes, -1, dtype=np.int64)
+        lookup[nodes] = np.arange(len(nodes))
+
+        # edges of the kept nodes, in the new node order
+        expanded = nodes[self.first[nodes] >= 0]
+        edges = [np.arange(self.first[node], self.first[node] + self.count[node])
+                 for node in expanded.tolist()]
+        edges = np.concatenate(edges) if edges else np.zeros(0, dtype=np.int64)
+        first = np.full(len(nodes), -1, dtype=np.int64)
+        first[lookup[expanded]] = np.cumsum(self.count[expanded]) - \
+            self.count[expanded]
+
+        tree = Tree(max(len(self.visits), len(nodes)))
+        tree.num_nodes = len(nodes)
+        tree.num_edges = len(edges)
+        if len(edges) > len(tree.children):
+            tree._grow_edges(len(edges))
+        tree.visits[:len(nodes)] = self.visits[nodes]
+        tree.value[:len(nodes)] = self.value[nodes]
+        tree.first[:len(nodes)] = first
+        tree.count[:len(nodes)] = self.count[nodes]
+        tree.proven[:len(nodes)] = self.proven[nodes]
+        tree.children[:len(edges)] = lookup[self.children[edges]]
+        tree.prior[:len(edges)] = self.prior[edges]
+        tree.actions = [self.actions[e] for e in edges.tolist()]
+        tree.states = [self.states[node] for node in order]
+        tree.index = {S[3]: i for i, S in enumerate(tree.states)}
+        self.__dict__.update(tree.__dict__)
+
+    def _grow_nodes(self):
+        size = len(self.visits)
+        self.visits = np.concatenate((self.visits, np.zeros(size)))
+        self.value = np.concatenate((self.value, np.zeros(size)))
+        self.first = np.concatenate(
+            (self.first, np.full(size, -1, dtype=np.int64)))
+        self.count = np.concatenate(
+            (self.count, np.zeros(size, dtype=np.int64)))
+        self.proven = np.concatenate((self.proven, np.full(size, np.nan)))
+
+    def _grow_edges(self, needed):
+        size = max(len(self.children), needed)
+        self.children = np.concatenate(
+            (self.children, np.zeros(size, dtype=np.int64)))
+        self.prior = np.concatenate((self.prior, np.zeros(size)))
+
+    def add(self, state):
+        """
+        Args:
+            state(tuple): a GameGlue state
+        returns:
+            node(int): the node of the state, created if it does not exist
+        """
+        node = self.index.get(state[3])
+        if node is None:
+            node = self.num_nodes
+            if node == len(self.visits):
+                self._grow_nodes()
+            self.index[state[3]] = node
+            self.states.append(state)
+            self.num_nodes += 1
+        return node
+
+    def expand(self, node, actions, states, priors=None):
+        """
+        Args:
+            node(int)
+            actions(list): legal actions from the node
+            states(list): states reached by each action
+            priors(list - optional): prior probability of each action
+
+        creates the edges from the node to its children
+        """
+        begin = self.num_edges
+        end = begin + len(actions)
+        if end > len(self.children):
+            self._grow_edges(end)
+        for i, S in enumerate(states):
+            self.children[begin + i] = self.add(S)
+        if priors is not None:
+            self.prior[begin:end] = priors
+        else:
+            self.prior[begin:end] = 1 / len(actions)
+        self.actions.extend(actions)
+        self.first[node] = begin
+        self.count[node] = len(actions)
+        self.num_edges = end
+
+    def edges(self, node):
+        """
+        returns the slice of the edge arrays holding the children of a node
+        """
+        begin = self.first[node]
+        return slice(begin, begin + self.count[node])
+
+    def select(self, node, C, use_prior=False):
+        """
+        Args:
+            node(int): an expanded node whose children were all visited
+            C(float): exploration constant
+            use_prior(bool): PUCT instead of UCB1
+
+        returns:
+            edge(int): the edge with the highest upper confidence bound
+        """
+        edges = self.edges(node)
+        kids = self.children[edges]
+        visits = self.visits[kids]
+        average = self.value[kids] / np.maximum(visits, 1)
+        total = visits.sum()
+        if use_prior:
+            # unvisited children are ranked by their prior alone
+            bound = average + C * self.prior[edges] * \
+                np.sqrt(max(total, 1)) / (1 + visits)
+        else:
+            bound = average + C * np.sqrt(np.log(total or 1) /
+                                          np.maximum(visits, 1))
+        return edges.start + int(np.argmax(bound))
+
+
+# search of a worker process of UCT.search_parallel, set by init_searcher
+searcher = None
+
+
+def init_searcher(ai):
+    """
+    Args:
+        ai(UCT): a copy of the search made by UCT.searcher, given once to
+            every worker process when the pool starts
+    """
+    global searcher
+    searcher = ai
+
+
+def search_root(state, seed, move_time):
+    """
+    Args:
+        state(tuple): the position to search, packed by GameGlue
+        seed(int): seed of the random generators of the worker
+        move_time(float): seconds of the search
 
-    def __init__(self, value=0, visits=0):
-        self.value = value
-        self.visits = visits
+    runs an independent search from state and returns the stats of the root
+    children, the number of playouts and the maximum depth searched
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    ai = searcher
+    ai.history = [state]
+    ai.calculation_time = move_time
+    ai.get_action(None)
+    return ai.data['actions'], ai.data['games'], ai.max_depth
 
 
 class UCT(object):
     def __init__(self, board, **kwargs):
         self.board = board
         self.history = []
-        self.stats = {}
+        self.tree = Tree()
 
         self.use_nn = False
         self.name = 'new'
@@ -32,57 +247,178 @@ class UCT(object):
 
         self.calculation_time = float(kwargs.get('time', 20))
         self.max_actions = int(kwargs.get('max_actions', 1000))
+        self.max_games = int(kwargs.get('max_games', 1600))
+
+        # Number of simulations run together, whose leaves are evaluated
+        # in one batch, and virtual loss keeping their paths apart.
+        self.parallel = int(kwargs.get('parallel', 1))
+        self.virtual_loss = float(kwargs.get('virtual_loss', 1))
 
         # Exploration constant, increase for more exploratory actions,
         # decrease to prefer actions with known higher win rates.
         self.C = float(kwargs.get('C', 1.4))
 
+        # With the neural network, evaluate the leaves with the value head
+        # instead of playing random games (AlphaZero), and mix Dirichlet
+        # noise into the priors of the root to explore other actions.
+        self.puct = bool(kwargs.get('puct', True))
+        self.dirichlet_alpha = float(kwargs.get('dirichlet_alpha', 0.3))
+        self.noise_fraction = float(kwargs.get('noise_fraction', 0.25))
+
+        # Number of processes searching the root independently, whose
+        # root stats are merged (only without the neural network). Only
+        # the stats of the root come back from the workers, so the tree is
+        # not reused for the next move (see memorize) in this mode.
+        self.workers = int(kwargs.get('workers', 1))
+        self.pool = None
+
+        # Exact solver (see solver.Solver) consulted when nodes are
+        # expanded. Proven nodes are not searched anymore and their
+        # results are propagated up the tree (MCTS-solver).
+        self.solver = kwargs.get('solver')
+
+        # Time management: with a clock of game_time seconds for the whole
+        # game, every move gets the remaining time divided by moves_to_go
+        # (at most calculation_time). The search also stops as soon as the
+        # most visited action cannot be overtaken with the playouts left.
+        # The time and the stopping rule are checked every check_every
+        # iterations.
+        self.game_time = kwargs.get('game_time')
+        self.moves_to_go = float(kwargs.get('moves_to_go', 20))
+        self.early_stop = bool(kwargs.get('early_stop', True))
+        self.check_every = int(kwargs.get('check_every', 16))
+        self.clock = None
+        self.search_stats = {'playouts': 0, 'time': 0.0, 'moves': 0,
+                      'stopped_early': 0}
+        self.new_game()
+
+    def __getstate__(self):
+        # the pool belongs to the process that created it
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def close(self):
+        # Terminates the worker processes of search_parallel.
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def searcher(self):
+        # Copy of the search for the workers of search_parallel, without
+        # the tree, searching in a single process for the time it is given.
+        ai = copy.copy(self)
+        ai.tree = Tree()
+        ai.history = []
+        ai.search_stats = dict(self.search_stats)
+        ai.workers = 1
+        ai.DEBUG = False
+        ai.memorize = False
+        ai.game_time = None
+        ai.clock = None
+        return ai
+
+    def new_game(self):
+        # Restarts the game clock.
+        if self.game_time is not None:
+            self.clock = float(self.game_time)
+
+    def move_time(self):
+        # Seconds allowed for the current move.
+        if self.clock is None:
+            return self.calculation_time
+        return min(self.calculation_time, self.clock / self.moves_to_go)
+
+    def playouts_per_second(self):
+        # Average speed of the search over all the moves so far.
+        stats = self.search_stats
+        return stats['playouts'] / max(stats['time'], 1e-9)
+
     def update(self, state):
         self.history.append(self.board.pack_state(state))
 
-    def get_action(self, names, inputs, outputs):
+    def get_action(self, evaluator):
         # Causes the AI to calculate the best action from the
-        # current game state and return it.
+        # current game state and return it. The evaluator (an object
+        # with a method pred(name, new_input), such as an InferenceClient)
+        # is used only when the neural network is enabled.
 
         self.max_depth = 0
         self.data = {}
-        self.stats.clear()
-        if self.memorize:
-            try:
-                current_stats = self.stats[self.history[-1]]
-                games = current_stats.visits
-            except:
-                games = 0
-        else:
-            self.stats.clear()
 
         state = self.history[-1]
         legal = self.board.legal_actions(state)
 
+        # Keep the subtree of the current position, which was explored
+        # while searching the previous moves, and count its playouts.
+        tree = self.tree
+        if self.memorize:
+            tree.reroot(state[3])
+        else:
+            tree.clear()
+        root = tree.add(state)
+        games = 0
+        if tree.first[root] >= 0:
+            games = int(tree.visits[tree.children[tree.edges(root)]].sum())
+
         # Bail out early if there is no real choice to be made.
         if not legal:
             return
         if len(legal) == 1:
             return legal[0]
 
-        begin = time.time()
-        while time.time() - begin < self.calculation_time:
-            if games >= 1600:
-                break
-            self.run_simulation(names, inputs, outputs)
-            games += 1
+        # A root proven while searching the previous moves is not searched
+        # again, but its children are still needed to pick the action.
+        if self.solver is not None and tree.first[root] < 0:
+            self.expand([root], evaluator)
 
-        names.put('done')
+        if self.use_nn and self.puct:
+            self.add_noise(root, evaluator)
+
+        begin = time.time()
+        move_time = self.move_time()
+        stopped_early = False
+        if self.workers > 1 and not self.use_nn:
+            games, actions = self.search_parallel(state, move_time)
+            searched = games
+        else:
+            searched = 0
+            iterations = 0
+            while games < self.max_games:
+                if iterations % self.check_every == 0:
+                    elapsed = time.time() - begin
+                    if elapsed >= move_time:
+                        break
+                    if self.decided(root, games, searched, elapsed, move_time):
+                        stopped_early = True
+                        break
+                self.run_simulation(evaluator)
+                games += self.parallel
+                searched += self.parallel
+                iterations += 1
+            actions = self.calculate_action_values(state, legal)
+        elapsed = time.time() - begin
+        if self.clock is not None:
+            self.clock = max(self.clock - elapsed, 0)
+
+        self.search_stats['playouts'] += searched
+        self.search_stats['time'] += elapsed
+        self.search_stats['moves'] += 1
+        self.search_stats['stopped_early'] += stopped_early
 
         # Display the number of calls of `run_simulation` and the
         # time elapsed.
         self.data.update(games=games, max_depth=self.max_depth,
-                         time=str(time.time() - begin))
+                         time=str(elapsed), stopped_early=stopped_early,
+                         playouts_per_second=searched / max(elapsed, 1e-9))
 
         # Store and display the stats for each possible action.
-        self.data['actions'] = self.calculate_action_values(state, legal)
+        self.data['actions'] = actions
         if self.DEBUG:
             print(self.data['games'], self.data['time'])
+            print("Playouts per second:",
+                  int(self.data['playouts_per_second']))
             print("Maximum depth searched:", self.max_depth)
             for m in self.data['actions']:
                 print(self.action_template.format(**m))
@@ -96,78 +432,273 @@ class UCT(object):
         # Pick the action with the highest average value.
         return self.data['actions'][0]['action']
 
-    def run_simulation(self, names, inputs, outputs):
-        # Plays out a "random" game from the current position,
-        # then updates the statistics tables with the result.
+    def decided(self, root, games, searched, elapsed, move_time):
+        # True when the most visited action of the root, which also has the
+        # best average, leads the second one by more visits than the
+        # playouts that can still be run in the time and games left.
+        tree = self.tree
+        if not np.isnan(tree.proven[root]):
+            return True
+        if not self.early_stop or not searched or tree.first[root] < 0:
+            return False
+        remaining = self.max_games - games
+        if elapsed > 0:
+            remaining = min(remaining, searched / elapsed * (move_time - elapsed))
+
+        kids = tree.children[tree.edges(root)]
+        visits = tree.visits[kids]
+        average = tree.value[kids] / np.maximum(visits, 1)
+        second, best = np.argsort(visits)[-2:]
+        return visits[best] - visits[second] > remaining and \
+            average[best] >= average.max()
+
+    def search_parallel(self, state, move_time):
+        # Root parallelization: every worker searches the current position
+        # with its own tree and its own seed, for the whole time budget.
+        # The stats of the root children are summed over the workers. The
+        # pool is kept for the next moves, and the search is copied to its
+        # workers once, so only the position is sent for every move.
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, init_searcher,
+                                             (self.searcher(),))
+        seeds = np.random.randint(2 ** 31, size=self.workers)
+        results = self.pool.starmap(
+            search_root,
+            [(state, int(seed), move_time) for seed in seeds])
+
+        merged = {}
+        games = 0
+        for actions, worker_games, max_depth in results:
+            games += worker_games
+            self.max_depth = max(self.max_depth, max_depth)
+            for m in actions:
+                key = str(m['action'])
+                if key not in merged:
+                    merged[key] = {'action': m['action'], 'sum': 0, 'plays': 0}
+                merged[key]['sum'] += m['sum']
+                merged[key]['plays'] += m['plays']
+        for m in merged.values():
+            m['average'] = m['sum'] / max(m['plays'], 1)
+
+        return games, sorted(merged.values(),
+                             key=lambda x: (x['average'], x['plays']),
+                             reverse=True)
+
+    def add_noise(self, root, evaluator):
+        # Mixes Dirichlet noise into the priors of the root, so that the
+        # search also tries the actions the policy head does not favour.
+        tree = self.tree
+        if tree.first[root] < 0:
+            self.expand([root], evaluator)
+        if self.noise_fraction <= 0:
+            return
+        edges = tree.edges(root)
+        noise = np.random.dirichlet([self.dirichlet_alpha] * tree.count[root])
+        tree.prior[edges] = (1 - self.noise_fraction) * tree.prior[edges] + \
+            self.noise_fraction * noise
+
+    def expand(self, nodes, evaluator):
+        # Creates the children of the nodes, with the prior probabilities
+        # given by the policy head when the neural network is used. All the
+        # nodes are evaluated with a single request. Returns the value head
+        # output of each node, from the perspective of the player to move.
+        tree = self.tree
+        board = self.board
+        legals = []
+        for node in nodes:
+            state = tree.states[node]
+            legal = board.legal_actions(state)
+            states = [board.next_state(state, p) for p in legal]
+            tree.expand(node, legal, states)
+            legals.append(legal)
+            if self.solver is not None:
+                self.prove(node, states)
+        if not self.use_nn or not nodes:
+            return {}
+
+        boards = []
+        for node in nodes:
+            board.scratch.decode(tree.states[node][2])
+            boards.append(board.scratch.board)
+        layers = board.scratch.encode_boards(boards)
+        vh_pred, ph_pred = evaluator.pred(self.name, layers)
+
+        values = {}
+        for node, legal, policy, value in zip(nodes, legals, ph_pred, vh_pred):
+            edges = tree.edges(node)
+            values[node] = float(value[0])
+            priors = np.array([policy[p] for p in legal])
+            if self.puct:
+                # the policy head is trained with a sigmoid per action
+                priors = 1 / (1 + np.exp(-priors))
+                tree.prior[edges] = priors / priors.sum()
+                continue
+            tree.prior[edges] = priors
+
+            # seed the statistics of the children with the policy head
+            kids = tree.children[edges]
+            unvisited = tree.visits[kids] == 0
+            tree.value[kids[unvisited]] = priors[unvisited]
+            tree.visits[kids[unvisited]] = 1
+        return values
+
+    def prove(self, node, states):
+        # Marks the children of a node which are the end of the game or
+        # are solved by the solver.
+        tree = self.tree
+        for kid, S in zip(tree.children[tree.edges(node)].tolist(), states):
+            if not np.isnan(tree.proven[kid]):
+                continue
+            if S[1]:
+                tree.proven[kid] = self.end_values(S) or 0
+            else:
+                value = self.solver.value(S)
+                if value is not None:
+                    # the solver scores the player to move
+                    tree.proven[kid] = -value
+
+    def propagate(self, path):
+        # Proves the nodes of the path from the last one up: a node is lost
+        # for the player who moved into it when one of its children is won
+        # for the player to move, otherwise it is proven once all its
+        # children are.
+        tree = self.tree
+        for node in reversed(path):
+            if not np.isnan(tree.proven[node]):
+                continue
+            if tree.first[node] < 0:
+                return
+            proven = tree.proven[tree.children[tree.edges(node)]]
+            if (proven == 1).any():
+                tree.proven[node] = -1
+            elif not np.isnan(proven).any():
+                tree.proven[node] = -proven.max()
+            else:
+                return
+
+    def choose(self, node):
+        # Picks the child to explore from an expanded node.
+        tree = self.tree
+        kids = tree.children[tree.edges(node)]
+        if self.use_nn or tree.visits[kids].all():
+            # If we have stats on all of the legal actions here,
+            # use the upper confidence bound.
+            return int(tree.children[tree.select(node, self.C, self.use_nn)])
+        # Otherwise, just make an arbitrary decision.
+        return int(choice(kids))
+
+    def descend(self):
+        # Follows the tree from the current position until a node that
+        # must be expanded, a position that was never visited (only with
+        # rollouts), or the end of the game. Returns the visited nodes, the last node, the
+        # number of plies and whether the last node must be expanded.
+        tree = self.tree
+        node = tree.add(self.history[-1])
+        path = []
+        t = 0
+        rollouts = not (self.use_nn and self.puct)
+        while not tree.states[node][1] and t < self.max_actions and \
+                np.isnan(tree.proven[node]):
+            if tree.first[node] < 0:
+                return path, node, t, True
+            t += 1
+            node = self.choose(node)
+            path.append(node)
+            if rollouts and tree.visits[node] == 0:
+                break
+        return path, node, t, False
+
+    def run_simulation(self, evaluator):
+        # Runs self.parallel simulations at once. Each one descends the
+        # tree with UCB1 (PUCT with the neural network), while virtual
+        # losses on the nodes already on a path steer the others away.
+        # The nodes at the end of the paths are expanded with one request,
+        # then a random game is played out from each new position and the
+        # statistics are updated with the results. In PUCT mode the value
+        # head output of the leaves is backed up instead.
 
         # A bit of an optimization here, so we have a local
         # variable lookup instead of an attribute access each loop.
-        stats = self.stats
-        visited_states = []
-        history_copy = self.history[:]
-        state = history_copy[-1]
-
-        expand = True
-        for t in range(1, self.max_actions + 1):
-            legal = self.board.legal_actions(history_copy[-1])
-            actions_states = [(p, self.board.next_state(state, p))
-                              for p in legal]
-
-            if all(S in stats for p, S in actions_states):
-                # If we have stats on all of the legal actions here, use UCB1.
-                log_total = log(
-                    sum(stats[S].visits for p, S in actions_states) or 1)
-                value, action, state = max(
-                    ((stats[S].value / (stats[S].visits or 1)) +
-                     self.C * sqrt(log_total / (stats[S].visits or 1)), p, S)
-                    for p, S in actions_states
-                )
-            else:
-                # Otherwise, just make an arbitrary decision.
-                if self.use_nn:
-                    names.put(self.name)
-                    inputs.put([self.board.game.layers()])
-                    vh_pred, ph_pred = outputs.get()
-                    ph_pred = ph_pred[0]
-                    for p, state in actions_states:
-                        stats[state] = Stat()
-                        stats[state].value = ph_pred[p]
-                        stats[state].visits = 1
-                    value, action, state = max(
-                        ((stats[S].value / (stats[S].visits or 1)) , p, S)
-                        for p, S in actions_states)
+        tree = self.tree
+        loss = self.virtual_loss
+        descents = []
+        for j in range(self.parallel):
+            path, node, t, expand = self.descend()
+            descents.append((path, node, t, expand))
+            if self.parallel > 1:
+                tree.visits[path] += loss
+                tree.value[path] -= loss
+
+        nodes = [node for path, node, t, expand in descents if expand]
+        values = self.expand(list(dict.fromkeys(nodes)), evaluator)
+
+        root = tree.add(self.history[-1])
+        for path, node, t, expand in descents:
+            if self.parallel > 1:
+                tree.visits[path] -= loss
+                tree.value[path] += loss
+            if self.use_nn and self.puct:
+                self.max_depth = max(self.max_depth, t)
+                if self.solver is not None and self.back_up_proven(root, path, node):
+                    continue
+                if node in values:
+                    # the value head scores the position for the player
+                    # to move, the leaf stores it for the previous one
+                    self.back_up(path, -values[node])
                 else:
-                    action, state = choice(actions_states)
-
-            history_copy.append(state)
-
-            if expand and state not in stats:
-                expand = False
-                stats[state] = Stat()
-                if t > self.max_depth:
-                    self.max_depth = t
-
-            visited_states.append(state)
-
-            # check if the game is ended
-            if history_copy[-1][1]:
-                break
+                    self.back_up(path, self.end_values(tree.states[node]) or 0)
+                continue
+            if expand:
+                t += 1
+                node = self.choose(node)
+                path.append(node)
+            if t > self.max_depth:
+                self.max_depth = t
+            if self.solver is not None and self.back_up_proven(root, path, node):
+                continue
+            self.play_out(path, tree.states[node], t)
+
+    def back_up_proven(self, root, path, node):
+        # Propagates the proofs along the path, and backs up the exact
+        # result instead of evaluating the last node when it is proven.
+        tree = self.tree
+        self.propagate([root] + path)
+        if np.isnan(tree.proven[node]):
+            return False
+        self.back_up(path, tree.proven[node])
+        return True
+
+    def back_up(self, path, result):
+        # Adds the result, from the perspective of the player who moved
+        # into the last node of the path, to the statistics of the path.
+        tree = self.tree
+        for node in reversed(path):
+            tree.visits[node] += 1
+            tree.value[node] += result
+            result = -result
+
+    def play_out(self, path, state, t):
+        # Plays a random game from the state, then updates the statistics
+        # of the nodes on the path with the result.
+        tree = self.tree
+        rollout = 0
+        if not state[1] and t < self.max_actions:
+            state, rollout = self.board.rollout(state, self.max_actions - t)
 
         # Back-propagation
-        end_values = self.end_values(history_copy[-1])
-        multiplier = -1
-        for i in range(len(visited_states)):
-            multiplier *= -1
-            state = visited_states[len(visited_states) - 1 - i]
-            if state not in stats:
-                continue
-            S = stats[state]
-            S.visits += 1
+        end_values = self.end_values(state) or 0
+        multiplier = -1 if rollout % 2 else 1
+        visits = tree.visits
+        value = tree.value
+        for i in range(len(path)):
+            node = path[len(path) - 1 - i]
+            visits[node] += 1
 
             if self.useDiscounting:
-                S.value += (end_values * multiplier)/(i + 1)
+                value[node] += (end_values * multiplier) / (rollout + i + 1)
             else:
-                S.value += end_values * multiplier
+                value[node] += end_values * multiplier
+            multiplier *= -1
 
 
 class UCTValues(UCT):
@@ -178,13 +709,26 @@ class UCTValues(UCT):
         self.end_values = board.win_values
 
     def calculate_action_values(self, state, legal):
-        actions_states = ((p, self.board.next_state(state, p)) for p in legal)
+        tree = self.tree
+        root = tree.add(state)
+        edges = tree.edges(root)
+        kids = tree.children[edges]
+        actions = tree.actions[edges]
+
+        # With canonical keys the root may be stored as a symmetric image
+        # of the current position, whose actions must be mapped back.
+        if tree.states[root][2] != state[2]:
+            s = self.board.symmetry(tree.states[root], state)
+            inverse = np.argsort(self.board.scratch.symmetries()[1][s])
+            actions = [int(inverse[p]) for p in actions]
+
         return sorted(
             ({'action': p,
-              'average': self.stats[S].value / self.stats[S].visits,
-              'sum': self.stats[S].value,
-              'plays': self.stats[S].visits}
-             for p, S in actions_states),
+              'average': tree.proven[S] if not np.isnan(tree.proven[S])
+              else tree.value[S] / max(tree.visits[S], 1),
+              'sum': tree.value[S],
+              'plays': int(tree.visits[S])}
+             for p, S in zip(actions, kids)),
             key=lambda x: (x['average'], x['plays']),
             reverse=True
         )